@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+"""
+Harness benchmarks.
+
+Measures the throughput of the hot paths of Harness running headless (dummy
+SDL drivers and software renderer), and saves the results in JSON so they can
+be compared between versions:
+
+    $ python benchmark.py -o before.json
+    $ python benchmark.py -o after.json --compare before.json
+"""
+from __future__ import division, print_function
+import os
+import json
+import ctypes
+import argparse
+import platform
+import tempfile
+from timeit import default_timer as timer
+
+import harness
+from harness import Harness, Controller, SpriteBatch
+
+import sdl2
+
+def measure(fn, number, repeat):
+    """Returns the best time per call of fn, in seconds"""
+    best = None
+    for r in range(repeat):
+        start = timer()
+        fn(number)
+        elapsed = (timer() - start) / number
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def bench_startup(number):
+    for i in range(number):
+        Harness(headless=True).close()
+
+def make_harness():
+    game = Harness(width=320, height=240, headless=True)
+    game._process_input()
+    return game
+
+def benchmarks(game, tmp_dir):
+    """Returns a list of (name, function, iterations) tuples"""
+    renderer = game.renderer_obj
+    tiles = game.load_resource("tiles.png")
+    tile = tiles.get_texture(24, 0, 24, 24)
+    font = game.load_bitmap_font("font.png", width=6, height=10)
+    text = "Copyright (c) 2015 usebox.net"
+
+    def bench_draw(number):
+        draw = renderer.draw
+        for i in range(number):
+            draw(tile, 10, 10)
+
+    def bench_draw_tint(number):
+        draw = renderer.draw
+        for i in range(number):
+            draw(tile, 10, 10, tint=(255, 0, 0, 255))
+
+    def bench_draw_text(number):
+        draw_text = renderer.draw_text
+        for i in range(number):
+            draw_text(font, 10, 10, text)
+
+    def bench_draw_text_cached(number):
+        draw_text = renderer.draw_text
+        for i in range(number):
+            draw_text(font, 10, 10, text, cache=True)
+
+    def bench_get_texture(number):
+        get_texture = tiles.get_texture
+        for i in range(number):
+            get_texture(24, 0, 24, 24)
+
+    def noop(dt):
+        pass
+
+    def bench_update(number):
+        handlers = game.update_handlers
+        game.update_handlers = [noop] * 10
+        for i in range(number):
+            game._update(game.UFPS_DT)
+        game.update_handlers = handlers
+
+    result = [("draw", bench_draw, 2000),
+              ("draw_tint", bench_draw_tint, 2000),
+              ("draw_text", bench_draw_text, 200),
+              ("draw_text_cached", bench_draw_text_cached, 2000),
+              ("get_texture", bench_get_texture, 20000),
+              ("update_dispatch_10_handlers", bench_update, 20000),
+              ]
+
+    try:
+        import numpy
+    except ImportError:
+        numpy = None
+
+    if numpy:
+        from harness.particles import ParticleSystem
+
+        particles = ParticleSystem([tile], max_particles=4000)
+        particles.burst(120, 120, 4000, life=1e6)
+
+        def bench_particles_update(number):
+            update = particles.update
+            for i in range(number):
+                update(game.UFPS_DT)
+
+        def bench_particles_draw(number):
+            for i in range(number):
+                particles.draw(renderer)
+
+        result.append(("particles_update_4000", bench_particles_update, 200))
+        result.append(("particles_draw_4000", bench_particles_draw, 5))
+
+        from harness.animation import Animation, AnimationSet
+
+        walk = Animation(tiles, [(0, 24, 24, 24), (24, 24, 24, 24)], delay=0.15)
+        anims = AnimationSet()
+        for i in range(500):
+            anims.add(walk)
+        xs = [(i * 7) % 300 for i in range(500)]
+        ys = [(i * 13) % 220 for i in range(500)]
+        anims_batch = SpriteBatch()
+
+        def bench_animations(number):
+            for i in range(number):
+                anims.tick(game.UFPS_DT)
+                anims.draw_all(anims_batch, xs, ys)
+                anims_batch.clear()
+
+        result.append(("animations_tick_draw_all_500", bench_animations, 200))
+
+    spatial_hash = harness.SpatialHash(32)
+    for i in range(1000):
+        spatial_hash.insert(i, (i * 37) % 640, (i * 91) % 480, 24, 24)
+
+    def bench_spatial_hash(number):
+        move = spatial_hash.move
+        pairs = spatial_hash.pairs
+        for i in range(number):
+            for obj in range(1000):
+                x, y = spatial_hash.rect(obj)[:2]
+                move(obj, x + 1 - (obj % 3), y)
+            pairs()
+
+    result.append(("spatial_hash_move_pairs_1000", bench_spatial_hash, 10))
+
+    controller = make_controller(game)
+    if controller:
+        def bench_poll(number):
+            poll = controller.poll
+            for i in range(number):
+                poll()
+
+        result.append(("controller_poll", bench_poll, 20000))
+
+    # files in formats not included in the data directory
+    surface = sdl2.SDL_CreateRGBSurfaceWithFormat(0, 240, 240, 32, sdl2.SDL_PIXELFORMAT_RGBA32)
+    sdl2.SDL_SaveBMP(surface, os.path.join(tmp_dir, "bench.bmp").encode())
+    sdl2.SDL_FreeSurface(surface)
+    write_wav(os.path.join(tmp_dir, "bench.wav"))
+    game.resource_path.append(tmp_dir)
+
+    for filename in ("bench.bmp", "title.png", "bench.wav", "boing.ogg"):
+        def bench_load(number, filename=filename):
+            for i in range(number):
+                game.load_resource(filename)
+                game.free_resource(filename)
+
+        result.append(("load_resource_%s" % filename.split(".")[-1], bench_load, 20))
+
+    return result
+
+def make_controller(game):
+    """Creates a virtual game controller, if supported by SDL"""
+    if not hasattr(sdl2, "SDL_JoystickAttachVirtual"):
+        return None
+
+    game._init_controllers()
+    index = sdl2.SDL_JoystickAttachVirtual(sdl2.SDL_JOYSTICK_TYPE_GAMECONTROLLER, 6, 15, 1)
+    if index < 0 or not sdl2.SDL_IsGameController(index):
+        return None
+
+    try:
+        return Controller(index, game)
+    except ValueError:
+        return None
+
+def write_wav(filename):
+    import wave
+
+    fd = wave.open(filename, "wb")
+    fd.setnchannels(2)
+    fd.setsampwidth(2)
+    fd.setframerate(44100)
+    # half a second, so it is loaded as a sample and not streamed
+    fd.writeframes(b"\0\0" * 2 * 22050)
+    fd.close()
+
+def sdl_version():
+    ver = sdl2.SDL_version()
+    sdl2.SDL_GetVersion(ctypes.byref(ver))
+    return "%i.%i.%i" % (ver.major, ver.minor, ver.patch)
+
+def run(names=None, repeat=3):
+    results = {}
+
+    def add(name, fn, number):
+        if names and name not in names:
+            return
+        elapsed = measure(fn, number, repeat)
+        results[name] = dict(usec_per_op=elapsed * 1e6,
+                             ops_per_sec=1.0 / elapsed if elapsed else 0.0,
+                             iterations=number,
+                             )
+        print("%-32s %12.2f us/op %14.1f op/s" % (name, elapsed * 1e6, results[name]["ops_per_sec"]))
+
+    add("startup", bench_startup, 3)
+
+    tmp_dir = tempfile.mkdtemp()
+    game = make_harness()
+    try:
+        for name, fn, number in benchmarks(game, tmp_dir):
+            add(name, fn, number)
+    finally:
+        game.close()
+        for name in os.listdir(tmp_dir):
+            os.remove(os.path.join(tmp_dir, name))
+        os.rmdir(tmp_dir)
+
+    return dict(harness=harness.version,
+                python=platform.python_version(),
+                sdl=sdl_version(),
+                platform=platform.platform(),
+                results=results,
+                )
+
+def compare(results, filename):
+    with open(filename) as fd:
+        previous = json.load(fd)
+
+    print("\nCompared to %s (harness %s):" % (filename, previous.get("harness")))
+    for name, result in sorted(results["results"].items()):
+        old = previous["results"].get(name)
+        if old:
+            print("%-32s %8.2fx" % (name, old["usec_per_op"] / result["usec_per_op"]))
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Harness benchmarks")
+    parser.add_argument("names", nargs="*", help="benchmarks to run (default: all)")
+    parser.add_argument("-o", "--output", help="save the results to a JSON file")
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+                        help="repetitions of each benchmark, the best is used (default: 3)")
+    parser.add_argument("-c", "--compare", help="JSON file with previous results to compare with")
+    args = parser.parse_args(args)
+
+    results = run(args.names, args.repeat)
+
+    if args.output:
+        with open(args.output, "w") as fd:
+            json.dump(results, fd, indent=2, sort_keys=True)
+
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == "__main__":
+    main()
@@ -27,6 +27,15 @@ from __future__ import division
 import sys
 import os
 import ctypes
+import io
+import weakref
+from collections import OrderedDict
+from timeit import default_timer as timer
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
 version = "0.2"
 
@@ -44,6 +53,16 @@ except ImportError as ex:
 
 # loads game controller definitions
 from .GameControllerDB import init_game_controller
+from . import atlas
+from .archive import Archive
+from .profiler import Profiler
+from .replay import Recorder, Replayer
+from .voices import VoicePool
+from .collision import SpatialHash
+from .tilemap import Tilemap
+from .batch import SpriteBatch, has_render_geometry
+from .layer import Layer
+from .loading import AsyncLoad
 
 class Harness(object):
     """
@@ -55,27 +74,119 @@ class Harness(object):
         width: with in pixels of the draw area.
         height: height in pixels of the draw area.
         zoom: scale up the output, or use 1 to disable.
+        ufps: updates per second of the game logic (defaults to UFPS).
+        max_updates: maximum number of updates per frame (defaults to
+          MAX_UPDATES); if the game can't keep up, it will slow down
+          instead of running more and more updates per frame.
+        vsync: synchronize the frames with the screen refresh.
+        fps: limit the frames per second (defaults to no limit). If vsync is
+          not available, the frames are limited to the refresh rate of the
+          display anyway.
+        headless: use dummy video and audio drivers, and render with a
+          software renderer into the surface attribute instead of a window.
+          The drivers are set in the environment until close is called.
+
+    The frame pacing in use is reported in the frame_pacing attribute:
+    "vsync", "limit" (frame limiter at target_fps), "vsync+limit" or "none".
+    If vsync is reported as available but the first frames are presented
+    much faster than the refresh rate, the frame limiter is used instead.
+
+    While the paused attribute is True the updates are not run and the
+    loop waits for events instead of drawing as fast as possible. The game
+    is paused when the window loses the focus, unless pause_on_focus_loss
+    is set to False.
+
+    If redraw_on_demand is set to True, frames are only drawn when the
+    dirty attribute is True (see redraw); otherwise the loop waits for the
+    next event or update.
 
     """
     UFPS = 80
     UFPS_DT = 1.0 / 80
 
+    MAX_UPDATES = 5
+
+    # fallback for the frame limiter if the refresh rate is unknown
+    FALLBACK_FPS = 60
+    # time to busy-wait at the end of a frame to be precise
+    SPIN_TIME = 0.002
+    # frames to measure to check that vsync works
+    VSYNC_CHECK_FRAMES = 30
+
     FONT_MAP = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789!?()@:/'., "
 
     AUDIO_CHANNELS = 6
+    MAX_AUDIO_CHANNELS = 32
+    AUDIO_FREQUENCY = 44100
+    # samples per audio buffer, smaller values reduce the latency
+    AUDIO_BUFFER = 1024
+
+    # .wav and .ogg files bigger than this (in bytes) are streamed as music
+    MUSIC_SIZE = 128 * 1024
+    # always streamed as music
+    MUSIC_EXTENSIONS = (".mp3", ".flac", ".opus", ".mod", ".xm", ".s3m", ".it", ".mid")
+    # returned by play for music
+    MUSIC_CHANNEL = -2
+    # size (in bytes) of music counted against the resource_budget; it is
+    # streamed, so only the decoder state is kept in memory
+    MUSIC_RESOURCE_SIZE = 64 * 1024
+
+    # game controller database, loaded from the resources if found
+    CONTROLLER_DB = "gamecontrollerdb.txt"
 
-    def __init__(self, title=None, width=320, height=200, zoom=1):
+    RESOURCE_BUDGET = None
+
+    LOADER_THREADS = 4
+    UPLOAD_BUDGET = 0.004
+
+    # events read from the queue at once
+    EVENT_BATCH = 32
+    # wait for events while paused, in milliseconds
+    PAUSE_WAIT = 100
+
+    def __init__(self, title=None, width=320, height=200, zoom=1, ufps=None, max_updates=None,
+                 vsync=True, fps=None, headless=False):
+
+        start = timer()
+        self.startup_times = OrderedDict()
 
         self.title = title.encode() if title else b"SDL2 Harness"
         self.width = width
         self.height = height
         self.zoom = zoom
 
+        if ufps:
+            self.UFPS = ufps
+            self.UFPS_DT = 1.0 / ufps
+        self.max_updates = max_updates or self.MAX_UPDATES
+
+        self.headless = headless
         self._quit = False
+        self._closed = False
+        self.profiler = None
+        self._recorder = None
+        self._replayer = None
         self._update_dt = 0
+        self.alpha = 0.0
         self.update_handlers = []
         self.draw_handlers = []
+        self.layers = []
         self._controllers = {}
+        self._auto_controllers = False
+        self._controllers_ready = False
+        self.controller_db = self.CONTROLLER_DB
+        self.controller_mappings = None
+        self._audio = False
+        self.audio_frequency = self.AUDIO_FREQUENCY
+        self.audio_buffer = self.AUDIO_BUFFER
+        self.audio_latency = None
+        self.voices = None
+        self._music = None
+        self._next_music = None
+        self.paused = False
+        self.pause_on_focus_loss = True
+        self.redraw_on_demand = False
+        self.dirty = True
 
         # try to find the script directory
         if "__main__" in globals():
@@ -92,30 +203,177 @@ class Harness(object):
                 os.path.join(main_dir, "data"),
                 ]
 
-        self.resources = {}
+        self.resources = OrderedDict()
+        self.resources_size = 0
+        self.resource_budget = self.RESOURCE_BUDGET
+
+        self.upload_budget = self.UPLOAD_BUDGET
+        self._loader = None
+        self._decoded = queue.Queue()
+
+        # previous values of the environment variables changed, restored by close
+        self._environ = {}
+        if headless:
+            # no display or audio device required
+            for var in ("SDL_VIDEODRIVER", "SDL_AUDIODRIVER"):
+                self._environ[var] = os.environ.get(var)
+                os.environ[var] = "dummy"
+
+        # audio and game controllers are initialized on first use
+        mark = timer()
+        sdl2.SDL_Init(sdl2.SDL_INIT_VIDEO)
+        self.startup_times["video"] = timer() - mark
+
+        mark = timer()
+        if headless:
+            self.window = None
+            self.surface = sdl2.SDL_CreateRGBSurfaceWithFormat(0,
+                                                               self.width * self.zoom,
+                                                               self.height * self.zoom,
+                                                               32,
+                                                               sdl2.SDL_PIXELFORMAT_RGBA32,
+                                                               )
+            self.renderer = sdl2.SDL_CreateSoftwareRenderer(self.surface)
+            vsync = False
+        else:
+            self.surface = None
+            self.window = sdl2.SDL_CreateWindow(self.title,
+                                                sdl2.SDL_WINDOWPOS_CENTERED,
+                                                sdl2.SDL_WINDOWPOS_CENTERED,
+                                                self.width * self.zoom,
+                                                self.height * self.zoom,
+                                                sdl2.SDL_WINDOW_HIDDEN
+                                                )
+            flags = sdl2.SDL_RENDERER_ACCELERATED
+            if vsync:
+                flags |= sdl2.SDL_RENDERER_PRESENTVSYNC
+            self.renderer = sdl2.SDL_CreateRenderer(self.window, -1, flags)
+        self.renderer_obj = Renderer(self.renderer, self.width, self.height)
+        self.startup_times["renderer"] = timer() - mark
+
+        self._set_frame_pacing(vsync, fps)
+
+        if self.zoom != 1:
+            sdl2.SDL_RenderSetScale(self.renderer, self.zoom, self.zoom)
 
-        for attr in dir(sdl2):
-            if attr.startswith("SDL_SCANCODE_"):
-                setattr(self, attr.replace("SDL_SCANCODE_", "KEY_"), getattr(sdl2, attr))
+        self._events = (sdl2.SDL_Event * self.EVENT_BATCH)()
+        self.event_handlers = {
+            sdl2.SDL_QUIT: [self._on_quit],
+            sdl2.SDL_CONTROLLERBUTTONDOWN: [self._on_controller_button],
+            sdl2.SDL_CONTROLLERBUTTONUP: [self._on_controller_button],
+            sdl2.SDL_JOYDEVICEADDED: [self._on_controller_added],
+            sdl2.SDL_CONTROLLERDEVICEADDED: [self._on_controller_added],
+            sdl2.SDL_CONTROLLERDEVICEREMOVED: [self._on_controller_removed],
+            sdl2.SDL_WINDOWEVENT: [self._on_window_event],
+            sdl2.SDL_RENDER_TARGETS_RESET: [self._on_targets_reset],
+            sdl2.SDL_RENDER_DEVICE_RESET: [self._on_targets_reset],
+        }
+
+        self.startup_times["total"] = timer() - start
+
+    def _init_audio(self):
+        """Initializes the audio on first use"""
+        if self._audio:
+            return
+        self._audio = True
 
-        sdl2.SDL_Init(sdl2.SDL_INIT_VIDEO|sdl2.SDL_INIT_AUDIO|sdl2.SDL_INIT_TIMER|sdl2.SDL_INIT_JOYSTICK)
-        init_game_controller()
+        start = timer()
+        sdl2.SDL_InitSubSystem(sdl2.SDL_INIT_AUDIO)
         sdlmixer.Mix_Init(sdlmixer.MIX_INIT_OGG)
-        sdlmixer.Mix_OpenAudio(44100, sdlmixer.MIX_DEFAULT_FORMAT, self.AUDIO_CHANNELS, 1024)
-
-        self.window = sdl2.SDL_CreateWindow(self.title,
-                                            sdl2.SDL_WINDOWPOS_CENTERED,
-                                            sdl2.SDL_WINDOWPOS_CENTERED,
-                                            self.width * self.zoom,
-                                            self.height * self.zoom,
-                                            sdl2.SDL_WINDOW_HIDDEN
-                                            )
-        self.renderer = sdl2.SDL_CreateRenderer(self.window, -1,
-                sdl2.SDL_RENDERER_ACCELERATED|sdl2.SDL_RENDERER_PRESENTVSYNC)
-        self.renderer_obj = Renderer(self.renderer)
+        sdlmixer.Mix_OpenAudio(self.audio_frequency, sdlmixer.MIX_DEFAULT_FORMAT, 2, self.audio_buffer)
 
-        if self.zoom != 1:
-            sdl2.SDL_RenderSetScale(self.renderer, self.zoom, self.zoom)
+        # the device may not support the requested frequency
+        frequency = ctypes.c_int()
+        if sdlmixer.Mix_QuerySpec(ctypes.byref(frequency), None, None) and frequency.value:
+            self.audio_frequency = frequency.value
+        self.audio_latency = self.audio_buffer / self.audio_frequency
+
+        self.voices = VoicePool(self.AUDIO_CHANNELS, self.MAX_AUDIO_CHANNELS)
+        self.startup_times["audio"] = timer() - start
+
+    def _init_controllers(self):
+        """Initializes the game controllers on first use"""
+        if self._controllers_ready:
+            return
+        self._controllers_ready = True
+
+        start = timer()
+        sdl2.SDL_InitSubSystem(sdl2.SDL_INIT_GAMECONTROLLER)
+        self.startup_times["controllers"] = timer() - start
+
+    def _load_controller_db(self):
+        """Adds the game controller mappings once there's a joystick"""
+        if self.controller_mappings is not None:
+            return
+
+        start = timer()
+        rw = None
+        if self.controller_db:
+            try:
+                rw = self._open_rw(self._find_path(self.controller_db))
+            except OSError:
+                pass
+        self.controller_mappings = init_game_controller(rw)
+        self.startup_times["controller_db"] = timer() - start
+
+    def startup_report(self):
+        """
+        Returns a text report of the time spent initializing Harness
+
+        The times in seconds are in the startup_times attribute; audio and
+        controllers are included once they have been initialized.
+        """
+        return "\n".join("%-12s %8.2f ms" % (name, elapsed * 1000)
+                         for name, elapsed in self.startup_times.items())
+
+    def _set_frame_pacing(self, vsync, fps):
+        has_vsync = False
+        if vsync:
+            info = sdl2.SDL_RendererInfo()
+            if sdl2.SDL_GetRendererInfo(self.renderer, ctypes.byref(info)) == 0:
+                has_vsync = bool(info.flags & sdl2.SDL_RENDERER_PRESENTVSYNC)
+
+        mode = sdl2.SDL_DisplayMode()
+        display = max(sdl2.SDL_GetWindowDisplayIndex(self.window), 0)
+        if sdl2.SDL_GetDesktopDisplayMode(display, ctypes.byref(mode)) == 0 and mode.refresh_rate:
+            self._refresh_rate = mode.refresh_rate
+        else:
+            self._refresh_rate = self.FALLBACK_FPS
+
+        if vsync and not has_vsync and not fps:
+            # avoid a busy loop limiting to the refresh rate
+            fps = self._refresh_rate
+
+        self.target_fps = fps
+        self._frame_period = 1.0 / fps if fps else 0
+
+        if has_vsync:
+            self.frame_pacing = "vsync+limit" if fps else "vsync"
+        else:
+            self.frame_pacing = "limit" if fps else "none"
+
+    def _check_vsync(self, elapsed):
+        """Uses the frame limiter if vsync doesn't seem to work"""
+        if elapsed < 0.5 * self.VSYNC_CHECK_FRAMES / self._refresh_rate:
+            self.target_fps = self._refresh_rate
+            self._frame_period = 1.0 / self._refresh_rate
+            self.frame_pacing = "limit"
+
+    def _limit_frame(self, freq):
+        """Waits until the next frame is due"""
+        now = sdl2.SDL_GetPerformanceCounter() / freq
+        if self._next_frame is None or now - self._next_frame > self._frame_period:
+            # first frame, or too late to keep the pace
+            self._next_frame = now + self._frame_period
+            return
+
+        remaining = self._next_frame - now
+        if remaining > self.SPIN_TIME:
+            sdl2.SDL_Delay(int((remaining - self.SPIN_TIME) * 1000))
+        while sdl2.SDL_GetPerformanceCounter() / freq < self._next_frame:
+            pass
+
+        self._next_frame += self._frame_period
 
     def set_icon(self, filename):
         """
@@ -125,8 +383,11 @@ class Harness(object):
         """
         from sdl2 import sdlimage
 
+        if not self.window:
+            return
+
         found_path = self._find_path(filename)
-        image = sdlimage.IMG_Load(found_path.encode())
+        image = sdlimage.IMG_Load_RW(self._open_rw(found_path), 1)
         if not image:
             sys.exit("Error loading %r: %s" % (filename, sdlimage.IMG_GetError()))
 
@@ -135,64 +396,408 @@ class Harness(object):
 
     def _update(self, dt):
 
-        self._update_dt += dt
-        while self._update_dt > self.UFPS_DT:
-            for update in self.update_handlers:
-                update(self.UFPS_DT)
+        profiler = self.profiler
+        updates = 0
+
+        # drop the time that can't be caught up
+        self._update_dt = min(self._update_dt + dt, self.max_updates * self.UFPS_DT)
+        while self._update_dt >= self.UFPS_DT:
+            if self._replayer and not self._replayer.apply(self.keys):
+                self._replayer = None
+            if self._recorder:
+                self._recorder.record(self.keys)
+
+            if profiler:
+                for update in self.update_handlers:
+                    start = timer()
+                    update(self.UFPS_DT)
+                    profiler.add_handler("update", update, timer() - start)
+            else:
+                for update in self.update_handlers:
+                    update(self.UFPS_DT)
             self._update_dt -= self.UFPS_DT
+            updates += 1
+
+        if profiler:
+            profiler.add_updates(updates)
+
+        # how far we are between the last update and the next one
+        self.alpha = self._update_dt / self.UFPS_DT
+        self.renderer_obj.alpha = self.alpha
 
     def _draw(self):
 
+        profiler = self.profiler
+        if profiler:
+            for draw in self.draw_handlers:
+                start = timer()
+                draw(self.renderer_obj)
+                profiler.add_handler("draw", draw, timer() - start)
+            profiler.draw_overlay(self.renderer_obj)
+            return
+
         for draw in self.draw_handlers:
             draw(self.renderer_obj)
 
+    def enable_profiler(self, font=None, dump=None):
+        """
+        Enables the frame profiler
+
+        Parameters:
+
+            font: BitmapFont to draw an overlay with the measures (optional).
+            dump: file name to save the measures when the game ends, in CSV
+              format if it ends in .csv or JSON otherwise (optional).
+
+        Returns the Profiler object (also in the profiler attribute).
+        """
+        if self.profiler is None:
+            self.profiler = Profiler(font, dump, self.renderer_obj)
+            self.profiler.start()
+        return self.profiler
+
+    def disable_profiler(self):
+        """Disables the frame profiler"""
+        if self.profiler:
+            self.profiler.stop()
+            self.profiler = None
+
+    def redraw(self):
+        """
+        Marks the frame to be drawn
+
+        Only required when redraw_on_demand is True: call it from an update
+        or event function when something changes on the screen (or from a
+        draw function to draw the next frame as well).
+        """
+        self.dirty = True
+
     def quit(self):
         """Quits the game"""
         self._quit = True
 
+    def _process_input(self):
+
+        self.keys = sdl2.SDL_GetKeyboardState(None)
+
+        events = self._events
+        size = len(events)
+        event_handlers = self.event_handlers
+
+        sdl2.SDL_PumpEvents()
+        while True:
+            count = sdl2.SDL_PeepEvents(events, size, sdl2.SDL_GETEVENT,
+                                        sdl2.SDL_FIRSTEVENT, sdl2.SDL_LASTEVENT)
+            for i in range(count):
+                event = events[i]
+                handlers = event_handlers.get(event.type)
+                if handlers:
+                    for handler in tuple(handlers):
+                        handler(event)
+            if count < size:
+                break
+
+        if not self._decoded.empty():
+            self._upload_resources()
+
+        if self._next_music and not sdlmixer.Mix_PlayingMusic():
+            self.play_music(*self._next_music)
+
+    def _on_quit(self, event):
+        self._quit = True
+
+    def _on_controller_button(self, event):
+        controller = self._controllers.get(event.cbutton.which)
+        if controller:
+            controller.handle_button(event.cbutton.button,
+                                     event.type == sdl2.SDL_CONTROLLERBUTTONDOWN)
+
+    def _on_controller_added(self, event):
+        # a joystick may be a game controller once the mappings are loaded
+        # (jdevice.which and cdevice.which are both the device index)
+        if self._auto_controllers:
+            self._open_controller(event.cdevice.which)
+
+    def _on_controller_removed(self, event):
+        controller = self._controllers.get(event.cdevice.which)
+        if controller:
+            controller.close()
+
+    def _on_window_event(self, event):
+        # the window may need to be drawn again (eg, exposed or resized)
+        self.dirty = True
+
+        if not self.pause_on_focus_loss:
+            return
+        if event.window.event == sdl2.SDL_WINDOWEVENT_FOCUS_LOST:
+            self.paused = True
+        elif event.window.event == sdl2.SDL_WINDOWEVENT_FOCUS_GAINED:
+            self.paused = False
+
+    def _on_targets_reset(self, event):
+        # the contents of the render targets are lost
+        self.renderer_obj.clear_text_cache()
+        self.renderer_obj._texture_modulated()
+        for layer in self.layers:
+            layer.invalidate()
+        for tilemap in self.renderer_obj._tilemaps:
+            tilemap.invalidate()
+
+    def on_event(self, event_type, fn=None):
+        """
+        Adds an event handler
+
+        Parameters:
+
+            event_type: SDL event type (eg, sdl2.SDL_KEYDOWN).
+            fn: handler to add, it gets the SDL_Event as parameter.
+
+        Can be used as decorator:
+
+            @harness.on_event(sdl2.SDL_MOUSEBUTTONDOWN)
+            def click(event):
+                ...
+
+        The event is only valid during the call to the handler.
+        """
+        if fn is None:
+            return lambda fn: self.on_event(event_type, fn)
+
+        self.event_handlers.setdefault(event_type, []).append(fn)
+        return fn
+
+    def _render(self):
+
+        sdl2.SDL_RenderClear(self.renderer)
+        self._draw()
+
+        profiler = self.profiler
+        if profiler:
+            start = timer()
+            sdl2.SDL_RenderPresent(self.renderer)
+            profiler.add_present(timer() - start)
+            profiler.end_frame()
+        else:
+            sdl2.SDL_RenderPresent(self.renderer)
+
     def loop(self):
         """The game loop!"""
-        sdl2.SDL_ShowWindow(self.window)
+        if self.window:
+            sdl2.SDL_ShowWindow(self.window)
 
         current = sdl2.SDL_GetPerformanceCounter()
         freq = sdl2.SDL_GetPerformanceFrequency()
+        self._next_frame = None
+        vsync_check = self.VSYNC_CHECK_FRAMES if self.frame_pacing == "vsync" else 0
+        vsync_start = current
         while not self._quit:
 
-            event = sdl2.SDL_Event()
-            while sdl2.SDL_PollEvent(ctypes.byref(event)) != 0:
-                if event.type == sdl2.SDL_QUIT:
-                    self._quit = True
-                    break
-
-            self.keys = sdl2.SDL_GetKeyboardState(None)
-            for controller in self._controllers.values():
-                controller.poll()
+            self._process_input()
 
             new = sdl2.SDL_GetPerformanceCounter()
+            if self.paused:
+                # keep the window contents but don't spin
+                current = new
+                if self.dirty or not self.redraw_on_demand:
+                    self.dirty = False
+                    self._render()
+                sdl2.SDL_WaitEventTimeout(None, self.PAUSE_WAIT)
+                continue
+
             self._update((new - current) / freq)
             current = new
 
-            sdl2.SDL_RenderClear(self.renderer)
-            self._draw()
-            sdl2.SDL_RenderPresent(self.renderer)
+            if self.redraw_on_demand and not self.dirty:
+                # nothing changed, wait for an event or the next update
+                wait = (self.UFPS_DT - self._update_dt) * 1000
+                sdl2.SDL_WaitEventTimeout(None, max(int(wait), 1))
+                continue
+
+            # draw functions can ask for the next frame too
+            self.dirty = False
+            self._render()
+
+            if self._frame_period:
+                self._limit_frame(freq)
+            elif vsync_check:
+                vsync_check -= 1
+                if not vsync_check:
+                    self._check_vsync((sdl2.SDL_GetPerformanceCounter() - vsync_start) / freq)
+
+        self.close()
 
-        for resource in self.resources.copy().keys():
-            self.free_resource(resource)
+    def step(self, n=1):
+        """
+        Runs updates of the game logic as fast as possible
+
+        Parameters:
+
+            n: number of updates to run.
+
+        Nothing is drawn. Returns the number of updates run (it may be less
+        than n if the game quits).
+        """
+        for i in range(n):
+            if self._quit:
+                return i
+            self._process_input()
+            self._update(self.UFPS_DT)
+        return n
+
+    def run_frames(self, n, dt=None):
+        """
+        Runs frames of the game loop as fast as possible
+
+        Parameters:
+
+            n: number of frames to run.
+            dt: time to simulate per frame (defaults to UFPS_DT).
+
+        Returns the number of frames run (it may be less than n if the
+        game quits).
+        """
+        if dt is None:
+            dt = self.UFPS_DT
+
+        for i in range(n):
+            if self._quit:
+                return i
+            self._process_input()
+            self._update(dt)
+            self._render()
+        return n
+
+    def start_recording(self, filename):
+        """
+        Records the keys in each update to a file
+
+        Parameters:
+
+            filename: file to save the log to.
+
+        The state of the keys (including the game controllers mapped to
+        keys) is recorded in each update, so it can be replayed later with
+        replay or start_replay.
+        """
+        self.stop_recording()
+
+        num_keys = ctypes.c_int()
+        self.keys = sdl2.SDL_GetKeyboardState(ctypes.byref(num_keys))
+        self._recorder = Recorder(filename, self.UFPS, num_keys.value)
+
+    def stop_recording(self):
+        """Stops recording the keys"""
+        if self._recorder:
+            self._recorder.close()
+            self._recorder = None
+
+    def start_replay(self, filename):
+        """
+        Replays the keys recorded with start_recording
+
+        Parameters:
+
+            filename: log recorded with start_recording.
+
+        The recorded state of the keys replaces the actual keys in each
+        update until the log ends. The log must have been recorded with
+        the same UFPS.
+        """
+        num_keys = ctypes.c_int()
+        self.keys = sdl2.SDL_GetKeyboardState(ctypes.byref(num_keys))
+        self._replayer = Replayer(filename, self.UFPS, num_keys.value)
+
+    def replay(self, filename, draw=False):
+        """
+        Replays the keys recorded with start_recording as fast as possible
+
+        Parameters:
+
+            filename: log recorded with start_recording.
+            draw: draw a frame after each update (defaults to False).
+
+        Returns the number of updates replayed.
+        """
+        self.start_replay(filename)
+        replayer = self._replayer
+
+        while not replayer.at_end and not self._quit:
+            if draw:
+                self.run_frames(1)
+            else:
+                self.step(1)
+
+        updates = replayer.updates
+        replayer.close()
+        self._replayer = None
+        return updates
+
+    def close(self):
+        """
+        Frees all the resources and quits SDL
+
+        It is called when the game loop ends, so it is only needed when
+        using step or run_frames instead of loop.
+        """
+        if self._closed:
+            return
+        self._closed = True
+
+        if self.profiler:
+            self.profiler.stop()
+            self.profiler.dump()
+
+        self.stop_recording()
+        if self._replayer:
+            self._replayer.close()
+            self._replayer = None
+
+        if self._loader:
+            self._loader.shutdown(wait=True)
+            self._loader = None
+        while not self._decoded.empty():
+            handle, filename, (kind, data, error) = self._decoded.get()
+            self._discard_decoded(kind, data)
+
+        self.renderer_obj.clear_text_cache()
+
+        for layer in self.layers:
+            self.renderer_obj.reset_texture_state(layer.texture)
+            layer.free()
+        self.layers = []
+
+        for resource in list(self.resources.keys()):
+            self._free_resource(resource)
+
+        for path in self.resource_path:
+            if isinstance(path, Archive):
+                path.close()
 
         for controller in list(self._controllers.values()):
             if controller.handler:
                 controller.close()
 
         sdl2.SDL_DestroyRenderer(self.renderer)
-        sdl2.SDL_HideWindow(self.window)
-        sdl2.SDL_DestroyWindow(self.window)
-
-        sdlmixer.Mix_Quit()
+        if self.window:
+            sdl2.SDL_HideWindow(self.window)
+            sdl2.SDL_DestroyWindow(self.window)
+        if self.surface:
+            sdl2.SDL_FreeSurface(self.surface)
+
+        if self._audio:
+            sdlmixer.Mix_CloseAudio()
+            sdlmixer.Mix_Quit()
         sdl2.SDL_Quit()
 
+        for var, value in self._environ.items():
+            if value is None:
+                os.environ.pop(var, None)
+            else:
+                os.environ[var] = value
+
     def remove_handler(self, fn):
         """
-        Remove a draw or update handler
+        Remove a draw, update or event handler
 
         Parameters:
 
@@ -202,6 +807,9 @@ class Harness(object):
             self.draw_handlers.remove(fn)
         if fn in self.update_handlers:
             self.update_handlers.remove(fn)
+        for handlers in self.event_handlers.values():
+            if fn in handlers:
+                handlers.remove(fn)
 
     def draw(self, fn):
         self.draw_handlers.append(fn)
@@ -211,7 +819,38 @@ class Harness(object):
         self.update_handlers.append(fn)
         return fn
 
-    def play(self, sample, loops=0):
+    def layer(self, fn=None, width=None, height=None):
+        """
+        Creates a layer from a draw function
+
+        Parameters:
+
+            fn: draw function to render the layer.
+            width: width of the layer (defaults to the draw area width).
+            height: height of the layer (defaults to the draw area height).
+
+        The draw function is rendered into a texture that is used by
+        Renderer.draw_layer until the layer is invalidated. It can be
+        used as a decorator, and returns a Layer object.
+        """
+        if fn is None:
+            return lambda fn: self.layer(fn, width, height)
+
+        layer = Layer(self.renderer, fn,
+                      width or self.width,
+                      height or self.height,
+                      )
+        self.layers.append(layer)
+        return layer
+
+    def remove_layer(self, layer):
+        """Frees a layer created with the layer method"""
+        if layer in self.layers:
+            self.layers.remove(layer)
+        self.renderer_obj.reset_texture_state(layer.texture)
+        layer.free()
+
+    def play(self, sample, loops=0, priority=0, limit=None):
         """
         Plays a sample loaded with load_resource
 
@@ -219,28 +858,194 @@ class Harness(object):
 
             sample: sample to play.
             loops: number of times to play the sample (-1 for infinite loop).
+            priority: if all the channels are busy, the sample replaces the
+              oldest sample playing with the same or lower priority.
+            limit: maximum number of instances of the sample playing at the
+              same time (the oldest is replaced; with 0 it is not played).
 
+        Returns the channel used, or -1 if the sample wasn't played. If the
+        sample is music, it is played with play_music.
         """
-        return sdlmixer.Mix_PlayChannel(-1, sample, loops)
+        if isinstance(sample, ctypes.POINTER(sdlmixer.Mix_Music)):
+            return self.play_music(sample, loops)
+        return self.voices.play(sample, loops, priority, limit)
 
     def stop_playback(self, channel=-1):
-        """Stops the audio playback"""
-        return sdlmixer.Mix_HaltChannel(channel)
+        """
+        Stops the audio playback
+
+        Parameters:
+
+            channel: channel returned by play, MUSIC_CHANNEL to stop the
+              music, or -1 to stop all channels and the music.
+
+        """
+        if not self._audio:
+            return 0
+        if channel in (-1, self.MUSIC_CHANNEL):
+            self.stop_music()
+            if channel == self.MUSIC_CHANNEL:
+                return 0
+        return self.voices.stop(channel)
+
+    def _music_loops(self, loops):
+        # SDL_mixer counts the times the music is played, not the repeats
+        return loops + 1 if loops >= 0 else -1
+
+    def play_music(self, music, loops=-1, fade_in=0, position=0):
+        """
+        Plays music loaded with load_music, replacing the music playing
+
+        Parameters:
+
+            music: music to play.
+            loops: number of times to repeat the music (-1 for infinite loop).
+            fade_in: time in seconds to fade in the music.
+            position: position in seconds to start playing from.
+
+        Returns MUSIC_CHANNEL (or -1 on error).
+        """
+        self._next_music = None
+        self._music = music
+
+        if fade_in or position:
+            result = sdlmixer.Mix_FadeInMusicPos(music, self._music_loops(loops), int(fade_in * 1000), position)
+        else:
+            result = sdlmixer.Mix_PlayMusic(music, self._music_loops(loops))
+        return -1 if result < 0 else self.MUSIC_CHANNEL
+
+    def fade_out_music(self, time):
+        """Fades out the music playing in time seconds"""
+        self._next_music = None
+        if self._audio:
+            sdlmixer.Mix_FadeOutMusic(int(time * 1000))
+
+    def stop_music(self):
+        """Stops the music playing"""
+        self._next_music = None
+        if self._audio:
+            sdlmixer.Mix_HaltMusic()
+
+    def crossfade_music(self, music, time, loops=-1, keep_position=False):
+        """
+        Replaces the music playing fading out and in
+
+        Parameters:
+
+            music: music to play.
+            time: time in seconds of the transition (half of it fading out
+              and half fading in).
+            loops: number of times to repeat the music (-1 for infinite loop).
+            keep_position: start the music from the position of the music
+              playing (eg, a faster version of the same track); requires
+              SDL_mixer 2.6 or later.
+
+        SDL_mixer plays only one music at a time, so the music starts in
+        the game loop once the music playing has faded out.
+        """
+        if not self._audio or not sdlmixer.Mix_PlayingMusic():
+            return self.play_music(music, loops, fade_in=time / 2)
+
+        position = 0
+        if keep_position and hasattr(sdlmixer, "Mix_GetMusicPosition"):
+            position = max(sdlmixer.Mix_GetMusicPosition(self._music), 0) + time / 2
+
+        sdlmixer.Mix_FadeOutMusic(int(time * 500))
+        self._next_music = (music, loops, time / 2, position)
+        return self.MUSIC_CHANNEL
 
     def free_resource(self, filename):
-        """Free resources"""
+        """
+        Free resources
 
+        The resource is freed once it has been released as many times as
+        it was loaded. If there's a resource_budget, it is kept in memory
+        and reused if loaded again, until the budget is exceeded.
+        """
         try:
-            free_fn = self.resources[filename]
+            entry = self.resources[filename]
         except KeyError:
             return
 
-        free_fn()
-        del self.resources[filename]
+        entry.refs -= 1
+        if entry.refs <= 0:
+            if self.resource_budget is None:
+                self._free_resource(filename)
+            else:
+                self._evict_resources()
+
+    def _free_resource(self, filename):
+        entry = self.resources.pop(filename)
+        self.resources_size -= entry.size
+        entry.free_fn()
+
+    def _evict_resources(self):
+        if self.resource_budget is None:
+            return
+
+        # least recently used first
+        for filename, entry in list(self.resources.items()):
+            if self.resources_size <= self.resource_budget:
+                break
+            if entry.refs <= 0:
+                self._free_resource(filename)
+
+    def _add_resource(self, filename, resource, free_fn, size):
+        self.resources[filename] = _Resource(resource, free_fn, size)
+        self.resources_size += size
+        self._evict_resources()
+
+    def _get_resource(self, filename):
+        """Returns a loaded resource (or None), increasing its references"""
+        entry = self.resources.pop(filename, None)
+        if entry is None:
+            return None
+
+        entry.refs = max(entry.refs, 0) + 1
+        self.resources[filename] = entry
+        return entry.resource
+
+    def add_archive(self, filename):
+        """
+        Adds a packed archive to the resource path
+
+        Parameters:
+
+            filename: archive file name (it is searched in the resource path).
+
+        The resources in the archive are found before the ones in any other
+        path. See harness.archive for details on how to create archives.
+        """
+        found_path = self._find_path(filename)
+        if isinstance(found_path, tuple):
+            raise OSError("Archive %r can't be inside another archive" % filename)
+
+        archive = Archive(found_path)
+        self.resource_path.insert(0, archive)
+        return archive
+
+    def _open_rw(self, found_path):
+        """Returns a SDL_RWops for a path returned by _find_path"""
+        if isinstance(found_path, tuple):
+            archive, name = found_path
+            return archive.open_rw(name)
+        return sdl2.SDL_RWFromFile(found_path.encode(), b"rb")
 
     def _find_path(self, filename):
+        """
+        Finds a resource in the resource path
+
+        Returns the full path of the file, or a tuple with the archive
+        and the name in the archive.
+        """
         found_path = None
         for path in self.resource_path:
+            if isinstance(path, Archive):
+                if filename in path:
+                    found_path = (path, filename)
+                    break
+                continue
+
             full_path = os.path.realpath(os.path.join(path, filename))
             if os.path.isfile(full_path):
                 found_path = full_path
@@ -259,52 +1064,396 @@ class Harness(object):
 
             filename: file name of the resource to load.
 
+        Loading an already loaded resource returns the same object (see
+        free_resource).
+
         The resource is identified based on its name:
 
             .bmp: image (using SDL2).
             .png, .gif, .jpg: image (using SDL2_Image)
-            .wav, .ogg: audio sample
+            .wav, .ogg: audio sample, or music if the file is bigger than
+              MUSIC_SIZE bytes (see load_music)
+            MUSIC_EXTENSIONS: music (see load_music)
 
         If the resource type is not identified, an open file handle
         is returned (is to the callee to close the file).
         """
 
+        resource = self._get_resource(filename)
+        if resource is not None:
+            return resource
+
         found_path = self._find_path(filename)
 
-        if filename[-4:] == ".bmp":
-            image = sdl2.SDL_LoadBMP(found_path.encode())
-            if not image:
-                sys.exit("Error loading %r: %s" % (filename, sdl2.SDL_GetError()))
+        if self._is_audio(filename):
+            self._init_audio()
 
-            resource = sdl2.SDL_CreateTextureFromSurface(self.renderer, image);
-            free_fn = lambda : sdl2.SDL_DestroyTexture(resource)
+        kind, data, error = self._decode_resource(filename, found_path)
+        if error:
+            sys.exit(error)
 
-            sdl2.SDL_FreeSurface(image)
-        elif filename[-4:] in (".png", ".gif", ".jpg"):
+        return self._create_resource(filename, kind, data)
+
+    def load_music(self, filename):
+        """
+        Loads music
+
+        Parameters:
+
+            filename: file name of the music to load.
+
+        The music is decoded while it plays instead of being loaded into
+        memory, and it is played with play_music (or play). Any format
+        supported by SDL2_Mixer can be used.
+
+        Loading an already loaded resource returns the same object (see
+        free_resource).
+        """
+        resource = self._get_resource(filename)
+        if resource is not None:
+            return resource
+
+        found_path = self._find_path(filename)
+
+        self._init_audio()
+
+        kind, data, error = self._decode_resource(filename, found_path, music=True)
+        if error:
+            sys.exit(error)
+
+        return self._create_resource(filename, kind, data)
+
+    def _is_audio(self, filename):
+        ext = os.path.splitext(filename)[1].lower()
+        return ext in (".wav", ".ogg") or ext in self.MUSIC_EXTENSIONS
+
+    def _is_music(self, filename, found_path):
+        ext = os.path.splitext(filename)[1].lower()
+        if ext in self.MUSIC_EXTENSIONS:
+            return True
+        if ext in (".wav", ".ogg"):
+            return self._path_size(found_path) > self.MUSIC_SIZE
+        return False
+
+    def _path_size(self, found_path):
+        if isinstance(found_path, tuple):
+            archive, name = found_path
+            return archive.index[name][1]
+        return os.path.getsize(found_path)
+
+    def _decode_resource(self, filename, found_path, music=None):
+        """
+        Loads the data of a resource (safe to use in a thread)
+
+        The audio must be initialized (in the main thread) before decoding
+        audio resources. Returns a tuple with the kind of resource, the data
+        and an error message (if any).
+        """
+        if music is None:
+            music = self._is_music(filename, found_path)
+
+        ext = os.path.splitext(filename)[1].lower()
+        if music:
+            # streamed from the file (or the archive)
+            data = sdlmixer.Mix_LoadMUS_RW(self._open_rw(found_path), 1)
+            if not data:
+                return (None, None, "Error loading %r: %s" % (filename, sdlmixer.Mix_GetError()))
+            return ("music", data, None)
+        elif ext == ".bmp":
+            image = sdl2.SDL_LoadBMP_RW(self._open_rw(found_path), 1)
+            if not image:
+                return (None, None, "Error loading %r: %s" % (filename, sdl2.SDL_GetError()))
+            return ("bmp", image, None)
+        elif ext in (".png", ".gif", ".jpg"):
             from sdl2 import sdlimage
 
-            image = sdlimage.IMG_Load(found_path.encode())
+            image = sdlimage.IMG_Load_RW(self._open_rw(found_path), 1)
             if not image:
-                sys.exit("Error loading %r: %s" % (filename, sdlimage.IMG_GetError()))
+                return (None, None, "Error loading %r: %s" % (filename, sdlimage.IMG_GetError()))
+            return ("image", image, None)
+        elif ext in (".wav", ".ogg"):
+            audio = sdlmixer.Mix_LoadWAV_RW(self._open_rw(found_path), 1)
+            if not audio:
+                return (None, None, "Error loading %r: %s" % (filename, sdlmixer.Mix_GetError()))
+            return ("audio", audio, None)
+
+        if isinstance(found_path, tuple):
+            archive, name = found_path
+            return ("file", io.BytesIO(archive.read(name)), None)
+        return ("file", open(found_path, "rb"), None)
+
+    def _create_resource(self, filename, kind, data):
+        """Creates a resource from its decoded data (main thread only)"""
+        if kind == "bmp":
+            image = data
+            resource = sdl2.SDL_CreateTextureFromSurface(self.renderer, image);
+            free_fn = lambda : self._destroy_texture(resource)
+            size = image.contents.w * image.contents.h * 4
 
+            sdl2.SDL_FreeSurface(image)
+        elif kind == "image":
+            image = data
             texture = sdl2.SDL_CreateTextureFromSurface(self.renderer, image);
-            free_fn = lambda : sdl2.SDL_DestroyTexture(texture)
+            free_fn = lambda : self._destroy_texture(texture)
             resource = Texture(texture, (0, 0, image.contents.w, image.contents.h))
+            size = image.contents.w * image.contents.h * 4
 
             sdl2.SDL_FreeSurface(image)
-        elif filename[-4:] in (".wav", ".ogg"):
-            audio = sdlmixer.Mix_LoadWAV(found_path.encode())
-            if not audio:
-                sys.exit("Error loading %r: %s" % (filename, sdlmixer.Mix_GetError()))
-
-            resource = audio
+        elif kind == "audio":
+            resource = data
             free_fn = lambda : sdlmixer.Mix_FreeChunk(resource)
+            size = data.contents.alen
+        elif kind == "music":
+            resource = data
+            free_fn = lambda : self._free_music(resource)
+            size = self.MUSIC_RESOURCE_SIZE
         else:
-            return open(filename, "rb")
+            return data
 
-        self.resources[filename] = free_fn
+        self._add_resource(filename, resource, free_fn, size)
         return resource
 
+    def _destroy_texture(self, texture):
+        self.renderer_obj.reset_texture_state(texture)
+        sdl2.SDL_DestroyTexture(texture)
+
+    def _free_music(self, music):
+        # the music is stopped if playing
+        if self._next_music and self._next_music[0] is music:
+            self._next_music = None
+        if self._music is music:
+            self._music = None
+        sdlmixer.Mix_FreeMusic(music)
+
+    def _discard_decoded(self, kind, data):
+        if kind in ("bmp", "image"):
+            sdl2.SDL_FreeSurface(data)
+        elif kind == "audio":
+            sdlmixer.Mix_FreeChunk(data)
+        elif kind == "music":
+            sdlmixer.Mix_FreeMusic(data)
+        elif kind == "file":
+            data.close()
+
+    def load_resources_async(self, filenames, callback=None):
+        """
+        Loads resources in the background
+
+        Parameters:
+
+            filenames: list of file names of the resources to load.
+            callback: optional function to call with the AsyncLoad object
+              once all the resources are loaded.
+
+        The files are decoded using LOADER_THREADS threads, and the textures
+        are created in the game loop, using up to upload_budget seconds per
+        frame. Returns an AsyncLoad object to follow the progress.
+
+        See load_resource for the supported resources.
+        """
+        handle = AsyncLoad(filenames, callback)
+
+        for filename in handle.filenames:
+            resource = self._get_resource(filename)
+            if resource is not None:
+                handle._loaded(filename, resource)
+                continue
+
+            if self._is_audio(filename):
+                # not from the loader threads
+                self._init_audio()
+
+            if self._loader is None:
+                from concurrent.futures import ThreadPoolExecutor
+                self._loader = ThreadPoolExecutor(self.LOADER_THREADS)
+            self._loader.submit(self._decode_async, handle, filename)
+
+        if not handle.filenames:
+            handle._check_done()
+
+        return handle
+
+    def _decode_async(self, handle, filename):
+        try:
+            decoded = self._decode_resource(filename, self._find_path(filename))
+        except Exception as ex:
+            decoded = (None, None, "Error loading %r: %s" % (filename, ex))
+        self._decoded.put((handle, filename, decoded))
+
+    def _upload_resources(self):
+        """Creates the resources loaded in the background, within the budget"""
+        freq = sdl2.SDL_GetPerformanceFrequency()
+        start = sdl2.SDL_GetPerformanceCounter()
+
+        while not self._decoded.empty():
+            handle, filename, (kind, data, error) = self._decoded.get()
+
+            if error:
+                handle._failed(filename, error)
+            else:
+                resource = self._get_resource(filename)
+                if resource is None:
+                    resource = self._create_resource(filename, kind, data)
+                else:
+                    # loaded meanwhile
+                    self._discard_decoded(kind, data)
+                handle._loaded(filename, resource)
+
+            if (sdl2.SDL_GetPerformanceCounter() - start) / freq > self.upload_budget:
+                break
+
+
+    def load_atlas(self, filenames, name="atlas", max_size=2048, padding=1, cache_path=None):
+        """
+        Loads images packed into one or more textures
+
+        Parameters:
+
+            filenames: list of image file names (.png, .gif, .jpg or .bmp).
+            name: name of the atlas resource (eg, to use with free_resource).
+            max_size: maximum width and height of the atlas textures.
+            padding: pixels to leave between images.
+            cache_path: directory to save the packed atlas, so it can be
+              loaded from there in later runs if the images haven't changed.
+
+        Returns a dictionary with the images as Texture objects by file name,
+        referencing a section of the atlas textures. Atlases with different
+        images must have different names.
+        """
+        from sdl2 import sdlimage
+
+        resource = self._get_resource(name)
+        if resource is not None:
+            if set(resource) != set(filenames):
+                self.resources[name].refs -= 1
+                raise ValueError("atlas %r already loaded with different images" % name)
+            return resource
+
+        info = sdl2.SDL_RendererInfo()
+        if sdl2.SDL_GetRendererInfo(self.renderer, ctypes.byref(info)) == 0:
+            if info.max_texture_width:
+                max_size = min(max_size, info.max_texture_width)
+            if info.max_texture_height:
+                max_size = min(max_size, info.max_texture_height)
+
+        layout = None
+        if cache_path:
+            layout = self._load_atlas_layout(cache_path, name, filenames, max_size, padding)
+
+        if layout:
+            surfaces = []
+            for page in range(layout["pages"]):
+                page_path = os.path.join(cache_path, "%s-%i.png" % (name, page))
+                image = sdlimage.IMG_Load(page_path.encode())
+                if not image:
+                    sys.exit("Error loading %r: %s" % (page_path, sdlimage.IMG_GetError()))
+                surfaces.append(image)
+            images = layout["images"]
+        else:
+            loaded = []
+            for filename in filenames:
+                found_path = self._find_path(filename)
+                if filename[-4:].lower() == ".bmp":
+                    image = sdl2.SDL_LoadBMP_RW(self._open_rw(found_path), 1)
+                else:
+                    image = sdlimage.IMG_Load_RW(self._open_rw(found_path), 1)
+                if not image:
+                    sys.exit("Error loading %r: %s" % (filename, sdlimage.IMG_GetError()))
+                loaded.append(image)
+
+            sizes = [(image.contents.w, image.contents.h) for image in loaded]
+            pages, positions = atlas.pack(sizes, max_size, max_size, padding)
+
+            surfaces = [sdl2.SDL_CreateRGBSurfaceWithFormat(0, width, height, 32,
+                                                            sdl2.SDL_PIXELFORMAT_RGBA32)
+                        for width, height in pages]
+
+            images = {}
+            for filename, image, size, (page, x, y) in zip(filenames, loaded, sizes, positions):
+                # copy the pixels as they are, including alpha
+                sdl2.SDL_SetSurfaceBlendMode(image, sdl2.SDL_BLENDMODE_NONE)
+                sdl2.SDL_BlitSurface(image, None, surfaces[page], sdl2.SDL_Rect(x, y, 0, 0))
+                sdl2.SDL_FreeSurface(image)
+                images[filename] = (page, x, y) + size
+
+            if cache_path:
+                self._save_atlas_layout(cache_path, name, surfaces, images, max_size, padding)
+
+        textures = []
+        size = 0
+        for surface in surfaces:
+            textures.append(sdl2.SDL_CreateTextureFromSurface(self.renderer, surface))
+            size += surface.contents.w * surface.contents.h * 4
+            sdl2.SDL_FreeSurface(surface)
+
+        def free_fn():
+            for texture in textures:
+                self._destroy_texture(texture)
+
+        resource = dict((filename, Texture(textures[rect[0]], tuple(rect[1:])))
+                        for filename, rect in images.items())
+        self._add_resource(name, resource, free_fn, size)
+        return resource
+
+    def _atlas_mtimes(self, filenames):
+        mtimes = {}
+        for filename in filenames:
+            try:
+                found_path = self._find_path(filename)
+                if isinstance(found_path, tuple):
+                    raise OSError("%r is in an archive" % filename)
+                mtimes[filename] = os.path.getmtime(found_path)
+            except OSError:
+                # the atlas may be distributed without the images
+                mtimes[filename] = None
+        return mtimes
+
+    def _load_atlas_layout(self, cache_path, name, filenames, max_size, padding):
+        import json
+
+        try:
+            with open(os.path.join(cache_path, "%s.json" % name)) as fd:
+                layout = json.load(fd)
+        except (OSError, IOError, ValueError):
+            return None
+
+        if layout.get("max_size") != max_size or layout.get("padding") != padding:
+            return None
+
+        if set(layout.get("images", ())) != set(filenames):
+            return None
+
+        for filename, mtime in self._atlas_mtimes(filenames).items():
+            if mtime is not None and layout["mtimes"].get(filename) != mtime:
+                return None
+
+        for page in range(layout["pages"]):
+            if not os.path.isfile(os.path.join(cache_path, "%s-%i.png" % (name, page))):
+                return None
+
+        return layout
+
+    def _save_atlas_layout(self, cache_path, name, surfaces, images, max_size, padding):
+        import json
+        from sdl2 import sdlimage
+
+        if not os.path.isdir(cache_path):
+            os.makedirs(cache_path)
+
+        for page, surface in enumerate(surfaces):
+            page_path = os.path.join(cache_path, "%s-%i.png" % (name, page))
+            if sdlimage.IMG_SavePNG(surface, page_path.encode()) != 0:
+                sys.exit("Error saving %r: %s" % (page_path, sdlimage.IMG_GetError()))
+
+        layout = dict(max_size=max_size,
+                      padding=padding,
+                      pages=len(surfaces),
+                      images=images,
+                      mtimes=self._atlas_mtimes(images.keys()),
+                      )
+        with open(os.path.join(cache_path, "%s.json" % name), "w") as fd:
+            json.dump(layout, fd)
+
     def load_bitmap_font(self, filename, width, height, font_map=None):
         """
         Loads a bitmap font
@@ -334,7 +1483,11 @@ class Harness(object):
     @property
     def has_controllers(self):
         """True if there are game controllers available"""
-        return sdl2.SDL_NumJoysticks() > 0
+        self._init_controllers()
+        if sdl2.SDL_NumJoysticks() > 0:
+            self._load_controller_db()
+            return True
+        return False
 
     @property
     def controllers(self):
@@ -342,31 +1495,169 @@ class Harness(object):
         Get a tuple of all detected game controllers
 
         By getting a controller from this list, the controller gets automatically
-        enabled and ready to use.
+        enabled and ready to use. After that, controllers connected later are
+        enabled automatically, and disconnected controllers are closed.
         """
+        self._init_controllers()
+
+        # from now on, controllers are enabled when connected
+        self._auto_controllers = True
+
         for joy in range(sdl2.SDL_NumJoysticks()):
-            if sdl2.SDL_IsGameController(joy):
-                controller = Controller(joy, self)
-                self._controllers[controller.name] = controller
+            self._open_controller(joy)
         return tuple(self._controllers.values())
 
+    def _open_controller(self, joy):
+        self._load_controller_db()
+        if not sdl2.SDL_IsGameController(joy):
+            return
+        if sdl2.SDL_JoystickGetDeviceInstanceID(joy) in self._controllers:
+            return
+
+        controller = Controller(joy, self)
+        self._controllers[controller.instance_id] = controller
+
+# key scancodes as class attributes (eg, Harness.KEY_ESCAPE)
+if "sdl2" in globals():
+    for _name, _value in vars(sdl2.scancode).items():
+        if _name.startswith("SDL_SCANCODE_"):
+            setattr(Harness, _name.replace("SDL_SCANCODE_", "KEY_"), _value)
+
+class _Resource(object):
+    """Loaded resource with its references count"""
+    def __init__(self, resource, free_fn, size):
+        self.resource = resource
+        self.free_fn = free_fn
+        self.size = size
+        self.refs = 1
+
+# colour of the textures when not tinted
+_WHITE = (255, 255, 255)
+# colour and alpha of a texture changed by SDL, unknown to the renderer
+_MODULATED = object()
+
 class Renderer(object):
-    """Wrapper for the renderer to be used by the draw functions"""
-    def __init__(self, renderer):
+    """
+    Wrapper for the renderer to be used by the draw functions
+
+    The alpha attribute is the fraction of the update period elapsed since
+    the last update (from 0.0 to 1.0), to interpolate positions when drawing.
+
+    Up to TEXT_CACHE_SIZE text runs are cached by draw_text (the least
+    recently used are freed first).
+
+    The colour, alpha and blend mode of the textures are tracked (for up to
+    TEXTURE_STATES textures, then they are set back to white, opaque and
+    their original blend mode, and forgotten) so they are only set when they
+    change. Drawing without tint only sets the colour and alpha back if they
+    were changed by the renderer, so they can also be set directly with SDL;
+    in that case use reset_texture_state after drawing the texture with a
+    tint. Call reset_texture_state too before destroying a texture drawn with
+    the renderer that wasn't loaded with Harness.
+    """
+    TEXT_CACHE_SIZE = 64
+    TEXTURE_STATES = 256
+
+    def __init__(self, renderer, width=None, height=None):
         self.renderer = renderer
+        self.width = width
+        self.height = height
+        self.alpha = 0.0
+        self.text_cache_size = self.TEXT_CACHE_SIZE
+        self._text_cache = OrderedDict()
+        self._texture_states = {}
+        # number of SDL render calls, for the profiler
+        self.copies = 0
+        # tile maps with chunks in render targets
+        self._tilemaps = weakref.WeakSet()
+        # scratch objects reused by the draw calls
+        self._src = sdl2.SDL_Rect()
+        self._dest = sdl2.SDL_Rect()
+        self._size = (ctypes.c_int(), ctypes.c_int())
+
+    def _set_texture_state(self, texture, color=None, alpha=None, blend=None):
+        """
+        Sets the colour, alpha and blend mode of a texture if they changed
+
+        Without colour, the colour and alpha are set back to white and opaque
+        only if they were changed by the renderer.
+        """
+        states = self._texture_states
+        state = states.get(id(texture))
+        if state is None or state[0] is not texture:
+            if color is None and blend is None:
+                return
+            if len(states) >= self.TEXTURE_STATES:
+                self._evict_texture_states()
+            # holding the texture, its id can't be reused by another one;
+            # None for the values not set by the renderer (and the blend mode
+            # of the texture before setting it)
+            state = states[id(texture)] = [texture, None, None, None, None]
+
+        if color is None:
+            if state[1] is not None:
+                color = _WHITE
+            if state[2] is not None:
+                alpha = 255
+
+        if color is not None:
+            if state[1] != color:
+                sdl2.SDL_SetTextureColorMod(texture, color[0], color[1], color[2])
+            state[1] = color
+        if alpha is not None and state[2] != alpha:
+            sdl2.SDL_SetTextureAlphaMod(texture, alpha)
+            state[2] = alpha
+        if blend is not None and state[3] != blend:
+            if state[4] is None:
+                original = sdl2.SDL_BlendMode()
+                sdl2.SDL_GetTextureBlendMode(texture, ctypes.byref(original))
+                state[4] = original.value
+            sdl2.SDL_SetTextureBlendMode(texture, blend)
+            state[3] = blend
+
+    def _evict_texture_states(self):
+        """Forgets all the textures, setting back the values changed by the renderer"""
+        for texture, color, alpha, blend, original in self._texture_states.values():
+            if color is not None and color != _WHITE:
+                sdl2.SDL_SetTextureColorMod(texture, 255, 255, 255)
+            if alpha is not None and alpha != 255:
+                sdl2.SDL_SetTextureAlphaMod(texture, 255)
+            if original is not None and blend != original:
+                sdl2.SDL_SetTextureBlendMode(texture, original)
+        self._texture_states.clear()
+
+    def _texture_modulated(self, texture=None):
+        """
+        Records that the colour and alpha of a texture were changed by SDL
 
-    def _get_rect(self, texture, rect=None):
-        _rect = rect
+        Some renderers leave the colour of the vertices as colour and alpha
+        of the texture after SDL_RenderGeometryRaw. With no texture, all the
+        textures tracked are set again on their next draw (eg, after the
+        renderer was reset).
+        """
+        if texture is None:
+            for state in self._texture_states.values():
+                state[1] = state[2] = _MODULATED
+                state[3] = None
+        else:
+            self._set_texture_state(texture, _WHITE, 255)
+            state = self._texture_states[id(texture)]
+            state[1] = state[2] = _MODULATED
 
-        if isinstance(texture, Texture):
-            _rect = texture.sdl_rect
+    def reset_texture_state(self, texture=None):
+        """
+        Forgets the colour, alpha and blend mode set to a texture
 
-        if isinstance(rect, tuple):
-            _rect = sdl2.SDL_Rect(*rect)
+        Parameters:
 
-        return _rect
+            texture: SDL texture (or Texture), or None for all the textures.
+        """
+        if texture is None:
+            self._texture_states.clear()
+        else:
+            self._texture_states.pop(id(getattr(texture, "texture", texture)), None)
 
-    def draw(self, texture, x=None, y=None, src_rect=None, dest_rect=None, tint=None):
+    def draw(self, texture, x=None, y=None, src_rect=None, dest_rect=None, tint=None, blend=None):
         """
         Draws a texture
 
@@ -375,31 +1666,66 @@ class Renderer(object):
             texture: texture created with Harness.load_resource or Texture.get_texture.
             x: horizontal location to draw the whole texture.
             y: vertical location to draw the whole texture.
-            src_rect: tuple with the rect defining the section of the texture to draw.
-            dest_rect: tuple with the rect defining the section of the destination. If
-              this parameter is used, x and y are ignored.
-            tint: colour the text texture, tuple with (r, g, b, alpha).
+            src_rect: tuple (or SDL_Rect, eg Texture.sdl_rect) with the rect defining
+              the section of the texture to draw.
+            dest_rect: tuple (or SDL_Rect) with the rect defining the section of the
+              destination. If this parameter is used, x and y are ignored.
+            tint: colour the texture, tuple with (r, g, b) or (r, g, b, alpha).
+            blend: SDL blend mode to set to the texture (eg, SDL_BLENDMODE_ADD).
+
+        If none of x, y or dest_rect are provided, a SDL texture is drawn on
+        the whole draw area, and a Texture at 0, 0.
         """
-
-        _texture = texture.texture
-        src = self._get_rect(texture, src_rect)
-
-        _dest_rect = dest_rect
-        if _dest_rect is None and all([x, y]):
-            _dest_rect = (x, y, texture.rect[2], texture.rect[3])
-        dest = self._get_rect(texture, _dest_rect)
-
-        if isinstance(tint, tuple) and len(tint) == 4:
-            sdl2.SDL_SetTextureColorMod(_texture, *tint)
+        if isinstance(texture, Texture):
+            _texture = texture.texture
+            src = texture.sdl_rect
+            width = texture.width
+            height = texture.height
         else:
-            tint = None
+            _texture = texture
+            src = None
+            width = None
+
+        if src_rect is not None:
+            if isinstance(src_rect, sdl2.SDL_Rect):
+                src = src_rect
+            else:
+                src = self._src
+                src.x, src.y, src.w, src.h = src_rect
+            width = src.w
+            height = src.h
+
+        if dest_rect is not None:
+            if isinstance(dest_rect, sdl2.SDL_Rect):
+                dest = dest_rect
+            else:
+                dest = self._dest
+                dest.x, dest.y, dest.w, dest.h = dest_rect
+        elif width is None and x is None and y is None:
+            dest = None
+        else:
+            if width is None:
+                w, h = self._size
+                sdl2.SDL_QueryTexture(_texture, None, None, w, h)
+                width = w.value
+                height = h.value
+            dest = self._dest
+            dest.x = x or 0
+            dest.y = y or 0
+            dest.w = width
+            dest.h = height
+
+        if tint is None:
+            state = self._texture_states.get(id(_texture))
+            if blend is not None or (state is not None and (state[1] is not _WHITE or state[2] != 255)):
+                self._set_texture_state(_texture, None, None, blend)
+        else:
+            self._set_texture_state(_texture, tint[:3], tint[3] if len(tint) > 3 else 255, blend)
 
         sdl2.SDL_RenderCopy(self.renderer, _texture, src, dest)
+        self.copies += 1
 
-        if tint:
-            sdl2.SDL_SetTextureColorMod(_texture, 255, 255, 255, 255)
-
-    def draw_text(self, font, x, y, text, align="left", tint=None):
+    def draw_text(self, font, x, y, text, align="left", tint=None, cache=False):
         """
         Draws text using a bitmap font
 
@@ -411,6 +1737,10 @@ class Renderer(object):
             text: the text to render.
             align: "left", "right" or "center" (defaults to "left").
             tint: colour the text texture, tuple with (r, g, b, alpha).
+            cache: render the text once into a texture and reuse it in
+              later calls with the same font, text and tint.
+
+        Characters not in the font map are skipped.
         """
         width = len(text) * font.width
 
@@ -420,6 +1750,24 @@ class Renderer(object):
         elif align == "right":
             x -= width
 
+        if not (isinstance(tint, tuple) and len(tint) == 4):
+            tint = None
+
+        if cache and text:
+            run = self._get_text_run(font, text, tint)
+            if run:
+                dest = self._dest
+                dest.x = x
+                dest.y = y
+                dest.w = width
+                dest.h = font.height
+                sdl2.SDL_RenderCopy(self.renderer, run, None, dest)
+                self.copies += 1
+                return
+
+        self._draw_glyphs(font, x, y, text, tint)
+
+    def _draw_glyphs(self, font, x, y, text, tint):
         src = sdl2.SDL_Rect(font.rect[0],
                             font.rect[1],
                             font.width,
@@ -427,19 +1775,174 @@ class Renderer(object):
                             )
         dest = sdl2.SDL_Rect(0, y, font.width, font.height)
 
-        if isinstance(tint, tuple) and len(tint) == 4:
-            sdl2.SDL_SetTextureColorMod(font.texture, *tint)
+        if tint:
+            self._set_texture_state(font.texture, tint[:3], tint[3])
         else:
-            tint = None
+            self._set_texture_state(font.texture)
 
+        glyphs = font.glyphs
+        copies = 0
         for i, c in enumerate(text):
-            index = font.font_map.find(c)
-            src.x = font.rect[0] + index * font.width
+            glyph_x = glyphs.get(c)
+            if glyph_x is None:
+                continue
+            src.x = glyph_x
             dest.x = x + i * font.width
             sdl2.SDL_RenderCopy(self.renderer, font.texture, src, dest)
+            copies += 1
+        self.copies += copies
 
-        if tint:
-            sdl2.SDL_SetTextureColorMod(font.texture, 255, 255, 255, 255)
+    def _get_text_run(self, font, text, tint):
+        key = (font, text, tint)
+        run = self._text_cache.pop(key, None)
+
+        if run is None:
+            if not sdl2.SDL_RenderTargetSupported(self.renderer):
+                return None
+
+            run = sdl2.SDL_CreateTexture(self.renderer,
+                                         sdl2.SDL_PIXELFORMAT_RGBA8888,
+                                         sdl2.SDL_TEXTUREACCESS_TARGET,
+                                         len(text) * font.width,
+                                         font.height,
+                                         )
+            if not run:
+                return None
+
+            sdl2.SDL_SetTextureBlendMode(run, sdl2.SDL_BLENDMODE_BLEND)
+
+            target = self._begin_target(run)
+            # the alpha is applied when the run is drawn
+            self._draw_glyphs(font, 0, 0, text, tint[:3] + (255,) if tint else None)
+            sdl2.SDL_SetRenderTarget(self.renderer, target)
+
+            if tint:
+                sdl2.SDL_SetTextureAlphaMod(run, tint[3])
+
+            while len(self._text_cache) >= max(self.text_cache_size, 1):
+                sdl2.SDL_DestroyTexture(self._text_cache.popitem(last=False)[1])
+
+        self._text_cache[key] = run
+        return run
+
+    def _begin_target(self, texture):
+        """Sets a transparent texture as render target, returns the previous one"""
+        target = sdl2.SDL_GetRenderTarget(self.renderer)
+        sdl2.SDL_SetRenderTarget(self.renderer, texture)
+
+        color = [ctypes.c_uint8() for i in range(4)]
+        sdl2.SDL_GetRenderDrawColor(self.renderer, *[ctypes.byref(c) for c in color])
+        sdl2.SDL_SetRenderDrawColor(self.renderer, 0, 0, 0, 0)
+        sdl2.SDL_RenderClear(self.renderer)
+        sdl2.SDL_SetRenderDrawColor(self.renderer, *[c.value for c in color])
+
+        return target
+
+    def draw_layer(self, layer, x=0, y=0):
+        """
+        Draws a layer, rendering it first if it was invalidated
+
+        Parameters:
+
+            layer: layer created with Harness.layer.
+            x: horizontal location to draw the layer.
+            y: vertical location to draw the layer.
+        """
+        if not layer.texture:
+            # no render target support, draw it directly
+            layer.draw_fn(self)
+            return
+
+        if layer.dirty:
+            target = self._begin_target(layer.texture)
+            layer.draw_fn(self)
+            sdl2.SDL_SetRenderTarget(self.renderer, target)
+            layer.dirty = False
+
+        dest = self._dest
+        dest.x = x
+        dest.y = y
+        dest.w = layer.width
+        dest.h = layer.height
+        sdl2.SDL_RenderCopy(self.renderer, layer.texture, None, dest)
+        self.copies += 1
+
+    def draw_tilemap(self, tilemap, x=0, y=0, viewport=None):
+        """
+        Draws the visible part of a tile map
+
+        Parameters:
+
+            tilemap: Tilemap to draw.
+            x: horizontal location to draw the viewport.
+            y: vertical location to draw the viewport.
+            viewport: tuple with the rect (in pixels) of the map to draw. By
+              default it is the size of the draw area from the top left corner
+              of the map.
+
+        Only the chunks of the map intersecting the viewport are drawn, and
+        the drawing is clipped to the viewport.
+        """
+        if viewport is None:
+            viewport = (0, 0,
+                        self.width or tilemap.pixel_width,
+                        self.height or tilemap.pixel_height,
+                        )
+        vx, vy, vw, vh = viewport
+
+        chunk_w = tilemap.chunk_size * tilemap.tile_width
+        chunk_h = tilemap.chunk_size * tilemap.tile_height
+
+        first_x = max(vx // chunk_w, 0)
+        last_x = min((vx + vw - 1) // chunk_w, tilemap.chunks_w - 1)
+        first_y = max(vy // chunk_h, 0)
+        last_y = min((vy + vh - 1) // chunk_h, tilemap.chunks_h - 1)
+
+        clip = sdl2.SDL_Rect()
+        sdl2.SDL_RenderGetClipRect(self.renderer, ctypes.byref(clip))
+        sdl2.SDL_RenderSetClipRect(self.renderer, sdl2.SDL_Rect(x, y, vw, vh))
+
+        dest = self._dest
+        dest.w = chunk_w
+        dest.h = chunk_h
+        for cy in range(first_y, last_y + 1):
+            for cx in range(first_x, last_x + 1):
+                chunk = tilemap._get_chunk(self, cx, cy)
+                if chunk:
+                    dest.x = x + cx * chunk_w - vx
+                    dest.y = y + cy * chunk_h - vy
+                    sdl2.SDL_RenderCopy(self.renderer, chunk, None, dest)
+                    self.copies += 1
+                else:
+                    # no render target support, draw it directly
+                    tilemap._render_chunk(self, cx, cy,
+                                          x + cx * chunk_w - vx,
+                                          y + cy * chunk_h - vy,
+                                          )
+
+        sdl2.SDL_RenderSetClipRect(self.renderer, clip if clip.w and clip.h else None)
+
+    def clear_text_cache(self):
+        """Frees all the text runs cached by draw_text"""
+        for run in self._text_cache.values():
+            sdl2.SDL_DestroyTexture(run)
+        self._text_cache.clear()
+
+    def draw_batch(self, batch, clear=True):
+        """
+        Draws all the sprites in a sprite batch
+
+        Parameters:
+
+            batch: SpriteBatch with the sprites to draw.
+            clear: empty the batch after drawing it (defaults to True).
+        """
+        for group in batch._groups:
+            if group.count:
+                group.submit(self, batch._indices)
+
+        if clear:
+            batch.clear()
 
 class Texture(object):
     """Wrapper for SDL textures and subtextures"""
@@ -473,6 +1976,10 @@ class BitmapFont(object):
         self.height = height
         self.font_map = font_map
 
+        # horizontal position of each glyph in the texture
+        self.glyphs = dict((c, self.rect[0] + index * width)
+                           for index, c in enumerate(font_map))
+
 class Controller(object):
     """Game controller"""
 
@@ -497,10 +2004,12 @@ class Controller(object):
                    )
 
     def __init__(self, joy_number, harness):
-        self.key_mapping = self.DEF_KEY_MAPPING
+        self.key_mapping = dict(self.DEF_KEY_MAPPING)
         self.harness = harness
         self.joy_number = joy_number
-        self.previous = dict((key, False) for key in self.MAPPING.keys())
+
+        harness._init_controllers()
+        harness._load_controller_db()
 
         # unlikely
         if not sdl2.SDL_IsGameController(joy_number):
@@ -511,17 +2020,27 @@ class Controller(object):
             raise ValueError("%r is not a support game controller" % joy_number)
 
         self.name = sdl2.SDL_GameControllerName(self.handler)
+        self.instance_id = sdl2.SDL_JoystickInstanceID(sdl2.SDL_GameControllerGetJoystick(self.handler))
+
+        # button constant to key scancode
+        self._button_keys = {}
+        self._state = {}
+        self._resolve_mapping()
 
     def __repr__(self):
         return u"<Controller: %r>" % self.name
 
+    def _resolve_mapping(self):
+        self._button_keys = dict((getattr(sdl2, self.MAPPING[action]), getattr(self.harness, key))
+                                 for action, key in self.key_mapping.items())
+
     def close(self):
         """Deactivate a game controller"""
         sdl2.SDL_GameControllerClose(self.handler)
         self.handler = None
 
-        if self.name in self.harness._controllers:
-            del self.harness._controllers[self.name]
+        if self.harness._controllers.get(self.instance_id) is self:
+            del self.harness._controllers[self.instance_id]
 
     def set_mapping(self, **kwargs):
         """
@@ -538,15 +2057,38 @@ class Controller(object):
         for key, value in kwargs.items():
             if key not in self.MAPPING.keys():
                 raise ValueError("%r is not a supported game controler to keyboard mapping" % key)
-            self.key_mapping[getattr(sdl2, key)] = value
+            if not hasattr(self.harness, value):
+                raise ValueError("%r is not a supported key" % value)
+            self.key_mapping[key] = value
+
+        # release the keys of the old mapping
+        for button, pressed in self._state.items():
+            if pressed and button in self._button_keys:
+                self.harness.keys[self._button_keys[button]] = False
+        self._state = {}
+
+        self._resolve_mapping()
+
+    def handle_button(self, button, pressed):
+        """Updates the key mapped to a button (called from the game loop)"""
+        key = self._button_keys.get(button)
+        if key is not None:
+            self.harness.keys[key] = pressed
+            self._state[button] = pressed
 
     def poll(self):
+        """
+        Updates the keys with the current state of the buttons
+
+        The game loop updates the keys using controller events, so this is
+        only required if the events are not processed.
+        """
         if not self.handler:
             return
 
-        for key, value in self.MAPPING.items():
-            state = sdl2.SDL_GameControllerGetButton(self.handler, getattr(sdl2, value)) == 1
-            if self.previous[key] != state:
-                self.harness.keys[getattr(self.harness, self.key_mapping[key])] = state
-            self.previous[key] = state
-
+        get_button = sdl2.SDL_GameControllerGetButton
+        for button, key in self._button_keys.items():
+            state = get_button(self.handler, button) == 1
+            if self._state.get(button, False) != state:
+                self.harness.keys[key] = state
+                self._state[button] = state
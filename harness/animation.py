@@ -0,0 +1,350 @@
+"""
+Sprite animations.
+
+This module requires NumPy, and it is not imported by harness:
+
+    from harness.animation import Animation, AnimationSet
+
+Part of Harness for pysdl2, see harness/__init__.py for license details.
+"""
+from __future__ import division
+import sys
+import ctypes
+from bisect import bisect_right
+
+try:
+    import sdl2
+except ImportError as ex:
+    if not hasattr(sys, "_gen_docs"):
+        sys.exit("SDL2 library not found: %s" % ex)
+
+try:
+    import numpy as np
+except ImportError as ex:
+    if not hasattr(sys, "_gen_docs"):
+        sys.exit("NumPy not found (required by harness.animation): %s" % ex)
+
+class Animation(object):
+    """
+    Animation clip with frames from a texture sheet
+
+    Parameters:
+
+        sheet: Texture with the frames.
+        rects: list of (x, y, width, height) tuples of the frames in the sheet.
+        delay: time in seconds per frame, or a list with the time of each frame.
+        loop: start again after the last frame (defaults to True), otherwise
+          the last frame is kept.
+
+    Animations are played by an AnimationSet.
+    """
+    def __init__(self, sheet, rects, delay=0.1, loop=True):
+        self.frames = [sheet.get_texture(*rect) for rect in rects]
+        if not self.frames:
+            raise ValueError("an animation requires at least one frame")
+        self.loop = loop
+
+        if isinstance(delay, (tuple, list)):
+            if len(delay) != len(self.frames):
+                raise ValueError("%i delays for %i frames" % (len(delay), len(self.frames)))
+            self.delay = None
+            # end time of each frame
+            self._ends = []
+            end = 0.0
+            for frame_delay in delay:
+                end += frame_delay
+                self._ends.append(end)
+            self.duration = end
+        else:
+            self.delay = delay
+            self._ends = None
+            self.duration = delay * len(self.frames)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def frame_index(self, elapsed):
+        """Returns the index of the frame after elapsed seconds"""
+        if elapsed >= self.duration:
+            if not self.loop:
+                return len(self.frames) - 1
+            elapsed %= self.duration
+
+        if self._ends is None:
+            return min(int(elapsed / self.delay), len(self.frames) - 1)
+        return min(bisect_right(self._ends, elapsed), len(self.frames) - 1)
+
+class AnimationSet(object):
+    """
+    Plays instances of animations
+
+    The time played and the current frame of all the instances are stored in
+    arrays, and they advance with one call to tick (eg, add it as an update
+    function with Harness.update). All the instances can be added to a
+    SpriteBatch with one call to draw_all.
+
+    Instances are identified by the integer returned by add.
+    """
+    def __init__(self, capacity=64):
+        self._animations = []
+        self._free = []
+        self._size = 0
+
+        # per instance: animation, time played, speed and frame (in _frames)
+        self._clip = np.zeros(capacity, dtype=np.intp)
+        self._elapsed = np.zeros(capacity, dtype=np.float64)
+        self._speed = np.zeros(capacity, dtype=np.float64)
+        self._frame = np.zeros(capacity, dtype=np.intp)
+        self._active = np.zeros(capacity, dtype=bool)
+
+        # per animation played
+        self._clips = {}
+        self._clip_first = np.zeros(0, dtype=np.intp)
+        self._clip_last = np.zeros(0, dtype=np.intp)
+        self._clip_duration = np.zeros(0, dtype=np.float64)
+        self._clip_loop = np.zeros(0, dtype=bool)
+        self._clip_base = np.zeros(0, dtype=np.float64)
+
+        # per frame of the animations played; the end times of the frames of
+        # each animation are offset by _clip_base so they are all sorted
+        self._frames = []
+        self._textures = []
+        self._ends = np.zeros(0, dtype=np.float64)
+        self._src = np.zeros((0, 4), dtype=np.int32)
+        self._uv = np.zeros((0, 8), dtype=np.float32)
+        self._texture = np.zeros(0, dtype=np.intp)
+
+    def __len__(self):
+        return self._size - len(self._free)
+
+    def _add_clip(self, animation):
+        """Adds the frames of an animation to the arrays, returns its index"""
+        clip = self._clips.get(id(animation))
+        if clip is not None and self._animations[clip] is animation:
+            return clip
+
+        clip = len(self._animations)
+        self._animations.append(animation)
+        self._clips[id(animation)] = clip
+
+        first = len(self._frames)
+        base = 0.0
+        if first:
+            base = self._clip_base[-1] + self._clip_duration[-1] + 1.0
+
+        if animation._ends is None:
+            ends = [animation.delay * (i + 1) for i in range(len(animation))]
+        else:
+            ends = animation._ends
+
+        uv = []
+        texture = []
+        for frame in animation.frames:
+            if frame.texture not in self._textures:
+                self._textures.append(frame.texture)
+            texture.append(self._textures.index(frame.texture))
+
+            w, h = ctypes.c_int(), ctypes.c_int()
+            sdl2.SDL_QueryTexture(frame.texture, None, None, ctypes.byref(w), ctypes.byref(h))
+            x, y, width, height = frame.rect
+            uv.append((x / w.value, y / h.value,
+                       (x + width) / w.value, y / h.value,
+                       (x + width) / w.value, (y + height) / h.value,
+                       x / w.value, (y + height) / h.value,
+                       ))
+
+        self._frames.extend(animation.frames)
+        self._ends = np.append(self._ends, np.add(ends, base))
+        self._src = np.append(self._src, np.array([frame.rect for frame in animation.frames], dtype=np.int32), axis=0)
+        self._uv = np.append(self._uv, np.array(uv, dtype=np.float32), axis=0)
+        self._texture = np.append(self._texture, texture)
+
+        self._clip_first = np.append(self._clip_first, first)
+        self._clip_last = np.append(self._clip_last, len(self._frames) - 1)
+        self._clip_duration = np.append(self._clip_duration, animation.duration)
+        self._clip_loop = np.append(self._clip_loop, animation.loop)
+        self._clip_base = np.append(self._clip_base, base)
+        return clip
+
+    def _grow(self):
+        capacity = 2 * len(self._active)
+        for name in ("_clip", "_elapsed", "_speed", "_frame", "_active"):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def tick(self, dt):
+        """Advances all the instances dt seconds, updating their frames"""
+        size = self._size
+        if not size:
+            return
+
+        elapsed = self._elapsed[:size]
+        elapsed += self._speed[:size] * dt
+        self._update_frames(slice(0, size))
+
+    def _update_frames(self, index):
+        clip = self._clip[index]
+        elapsed = self._elapsed[index]
+        duration = self._clip_duration[clip]
+
+        time = np.where(self._clip_loop[clip],
+                        np.mod(elapsed, duration),
+                        np.clip(elapsed, 0.0, duration),
+                        )
+        frame = np.searchsorted(self._ends, time + self._clip_base[clip], side="right")
+        self._frame[index] = np.minimum(frame, self._clip_last[clip])
+
+    def add(self, animation, speed=1.0):
+        """
+        Adds an instance of an animation
+
+        Parameters:
+
+            animation: Animation to play.
+            speed: playback speed (1.0 is the speed of the animation).
+
+        Returns the instance identifier.
+        """
+        if self._free:
+            handle = self._free.pop()
+        else:
+            if self._size == len(self._active):
+                self._grow()
+            handle = self._size
+            self._size += 1
+
+        self._active[handle] = True
+        self._speed[handle] = speed
+        self._start(handle, animation)
+        return handle
+
+    def _start(self, handle, animation):
+        clip = self._add_clip(animation)
+        self._clip[handle] = clip
+        self._elapsed[handle] = 0.0
+        self._frame[handle] = self._clip_first[clip]
+
+    def remove(self, handle):
+        """Removes an instance"""
+        if self._active[handle]:
+            self._active[handle] = False
+            self._speed[handle] = 0.0
+            self._free.append(handle)
+
+    def animation(self, handle):
+        """Returns the Animation played by an instance"""
+        return self._animations[self._clip[handle]]
+
+    def elapsed(self, handle):
+        """Returns the time in seconds played of an instance"""
+        return float(self._elapsed[handle])
+
+    def play(self, handle, animation, restart=False):
+        """
+        Changes the animation of an instance
+
+        Parameters:
+
+            handle: instance identifier.
+            animation: Animation to play.
+            restart: start from the first frame even if the animation is
+              already playing.
+        """
+        if animation is not self.animation(handle) or restart:
+            self._start(handle, animation)
+
+    def set_speed(self, handle, speed):
+        """Changes the playback speed of an instance (0 pauses it)"""
+        self._speed[handle] = speed
+
+    def frame(self, handle):
+        """Returns the Texture of the current frame of an instance"""
+        return self._frames[self._frame[handle]]
+
+    def done(self, handle):
+        """True if an instance of an animation that doesn't loop has ended"""
+        animation = self.animation(handle)
+        return not animation.loop and self._elapsed[handle] >= animation.duration
+
+    def draw(self, batch, handle, x, y, tint=None):
+        """
+        Adds the current frame of an instance to a SpriteBatch
+
+        Parameters:
+
+            batch: SpriteBatch to add the frame to.
+            handle: instance identifier.
+            x: horizontal position.
+            y: vertical position.
+            tint: colour the frame, tuple with (r, g, b, alpha).
+        """
+        batch.add(self.frame(handle), x, y, tint=tint)
+
+    def handles(self):
+        """Returns an array with the identifiers of the instances, in order"""
+        return np.flatnonzero(self._active[:self._size])
+
+    def draw_all(self, batch, xs, ys, handles=None, tint=None):
+        """
+        Adds the current frame of several instances to a SpriteBatch
+
+        Parameters:
+
+            batch: SpriteBatch to add the frames to.
+            xs: horizontal positions (a sequence or array).
+            ys: vertical positions (a sequence or array).
+            handles: instance identifiers; by default all the instances in the
+              order returned by handles.
+            tint: colour the frames, tuple with (r, g, b, alpha).
+
+        The frames are added with one call per texture.
+        """
+        if handles is None:
+            handles = self.handles()
+        frame = self._frame[handles]
+        count = len(frame)
+        if not count:
+            return
+
+        x = np.asarray(xs, dtype=np.float32)[:count]
+        y = np.asarray(ys, dtype=np.float32)[:count]
+        src = self._src[frame]
+
+        if len(self._textures) == 1:
+            selections = [(0, slice(None))]
+        else:
+            textures = self._texture[frame]
+            selections = [(texture, textures == texture) for texture in np.unique(textures)]
+
+        for texture, sel in selections:
+            src_sel = src[sel]
+            x0 = x[sel]
+            y0 = y[sel]
+            width = src_sel[:, 2]
+            height = src_sel[:, 3]
+            selected = len(src_sel)
+
+            if batch.geometry:
+                xy = np.empty((selected, 8), dtype=np.float32)
+                x1 = x0 + width
+                y1 = y0 + height
+                xy[:, 0] = x0
+                xy[:, 1] = y0
+                xy[:, 2] = x1
+                xy[:, 3] = y0
+                xy[:, 4] = x1
+                xy[:, 5] = y1
+                xy[:, 6] = x0
+                xy[:, 7] = y1
+                batch._add_many(self._textures[texture], tint, selected,
+                                xy=xy.tobytes(), uv=self._uv[frame[sel]].tobytes())
+            else:
+                dest = np.empty((selected, 4), dtype=np.int32)
+                dest[:, 0] = x0
+                dest[:, 1] = y0
+                dest[:, 2] = width
+                dest[:, 3] = height
+                batch._add_many(self._textures[texture], tint, selected,
+                                src=src_sel.tobytes(), dest=dest.tobytes())
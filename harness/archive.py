@@ -0,0 +1,134 @@
+"""
+Packed resource archives.
+
+An archive is a header, the contents of the files one after the other, and
+an index in JSON with the offset and size of each file by name.
+
+Archives can be created from a directory with:
+
+    $ python -m harness.archive data data.pak
+
+Part of Harness for pysdl2, see harness/__init__.py for license details.
+"""
+import sys
+import os
+import ctypes
+import json
+import mmap
+import struct
+
+try:
+    import sdl2
+except ImportError as ex:
+    if not hasattr(sys, "_gen_docs"):
+        sys.exit("SDL2 library not found: %s" % ex)
+
+MAGIC = b"HPAK"
+VERSION = 1
+
+# magic, version, index offset, index size
+HEADER = struct.Struct("<4sIQI")
+
+class Archive(object):
+    """
+    Packed archive of resources
+
+    Parameters:
+
+        filename: path to the archive.
+
+    The archive is memory mapped and the resources are provided to SDL
+    without copying them. Add it to Harness.resource_path (or use
+    Harness.add_archive) to load resources from it.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+
+        with open(filename, "rb") as fd:
+            self._map = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_COPY)
+
+        magic, version, index_offset, index_size = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            self._map.close()
+            raise ValueError("%r is not a supported archive" % filename)
+
+        index = self._map[index_offset:index_offset + index_size]
+        self.index = json.loads(index.decode("utf-8"))
+
+        # the map is copy on write, so the export doesn't copy the file
+        self._buffer = ctypes.c_char.from_buffer(self._map)
+        self._address = ctypes.addressof(self._buffer)
+
+    def __repr__(self):
+        return "<Archive: %r>" % self.filename
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def read(self, name):
+        """Returns the contents of a file in the archive"""
+        offset, size = self.index[name]
+        return self._map[offset:offset + size]
+
+    def open_rw(self, name):
+        """Returns a SDL_RWops reading from the memory of a file in the archive"""
+        offset, size = self.index[name]
+        return sdl2.SDL_RWFromConstMem(self._address + offset, size)
+
+    def close(self):
+        """Closes the archive"""
+        if self._map is not None:
+            del self._buffer
+            self._map.close()
+            self._map = None
+
+def pack(path, filename):
+    """
+    Packs the files in a directory into an archive
+
+    Parameters:
+
+        path: directory with the files to pack (including subdirectories).
+        filename: path to the archive to create.
+    """
+    index = {}
+
+    with open(filename, "wb") as fd:
+        fd.write(HEADER.pack(MAGIC, VERSION, 0, 0))
+
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                full_path = os.path.join(root, name)
+                if os.path.abspath(full_path) == os.path.abspath(filename):
+                    continue
+
+                with open(full_path, "rb") as src:
+                    data = src.read()
+
+                key = os.path.relpath(full_path, path).replace(os.sep, "/")
+                index[key] = (fd.tell(), len(data))
+                fd.write(data)
+
+        data = json.dumps(index, sort_keys=True).encode("utf-8")
+        index_offset = fd.tell()
+        fd.write(data)
+
+        fd.seek(0)
+        fd.write(HEADER.pack(MAGIC, VERSION, index_offset, len(data)))
+
+    return index
+
+def main(args=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Packs a directory into a Harness archive")
+    parser.add_argument("path", help="directory with the resources")
+    parser.add_argument("filename", help="archive to create")
+    args = parser.parse_args(args)
+
+    index = pack(args.path, args.filename)
+    print("%i files packed into %s" % (len(index), args.filename))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Rectangle packing for texture atlases.
+
+Part of Harness for pysdl2, see harness/__init__.py for license details.
+"""
+
+def pack(sizes, max_width, max_height, padding=0):
+    """
+    Packs rectangles into pages using shelves
+
+    Parameters:
+
+        sizes: sequence of (width, height) tuples.
+        max_width: maximum width of a page.
+        max_height: maximum height of a page.
+        padding: pixels to leave between rectangles.
+
+    Returns a tuple with the list of (width, height) of the pages and
+    the list of (page, x, y) positions, in the same order as sizes.
+
+    The rectangles are sorted by height and placed in the first shelf
+    with enough room, opening a new shelf or a new page when required.
+    """
+    positions = [None] * len(sizes)
+    pages = []
+    # shelves per page as [y, height, next x]
+    shelves = []
+
+    order = sorted(range(len(sizes)), key=lambda i: (-sizes[i][1], -sizes[i][0]))
+    for i in order:
+        width, height = sizes[i]
+        if width > max_width or height > max_height:
+            raise ValueError("%r doesn't fit in a %ix%i page" % (sizes[i], max_width, max_height))
+
+        placed = False
+        for page, page_shelves in enumerate(shelves):
+            for shelf in page_shelves:
+                if height <= shelf[1] and shelf[2] + width <= max_width:
+                    positions[i] = (page, shelf[2], shelf[0])
+                    shelf[2] += width + padding
+                    placed = True
+                    break
+
+            if not placed:
+                last = page_shelves[-1]
+                y = last[0] + last[1] + padding
+                if y + height <= max_height:
+                    page_shelves.append([y, height, width + padding])
+                    positions[i] = (page, 0, y)
+                    placed = True
+
+            if placed:
+                break
+
+        if not placed:
+            shelves.append([[0, height, width + padding]])
+            positions[i] = (len(shelves) - 1, 0, 0)
+
+    for page_shelves in shelves:
+        width = max(shelf[2] for shelf in page_shelves) - padding
+        last = page_shelves[-1]
+        pages.append((width, last[0] + last[1]))
+
+    return pages, positions
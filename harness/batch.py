@@ -0,0 +1,241 @@
+"""
+Sprite batches.
+
+Part of Harness for pysdl2, see harness/__init__.py for license details.
+"""
+from __future__ import division
+import sys
+import ctypes
+from array import array
+
+try:
+    import sdl2
+except ImportError as ex:
+    if not hasattr(sys, "_gen_docs"):
+        sys.exit("SDL2 library not found: %s" % ex)
+
+# colour of the vertices of the sprites not tinted
+_OPAQUE_WHITE = (255, 255, 255, 255)
+
+class _BatchGroup(object):
+    """
+    Sprites in a SpriteBatch sharing texture (and tint without geometry)
+
+    With geometry the tint is in the colour of the vertices.
+    """
+    def __init__(self, key, texture, tint, geometry):
+        self.key = key
+        self.texture = texture
+        self.tint = tint
+        self.geometry = geometry
+        self.count = 0
+
+        if geometry:
+            w, h = ctypes.c_int(), ctypes.c_int()
+            sdl2.SDL_QueryTexture(texture, None, None, ctypes.byref(w), ctypes.byref(h))
+            self.tex_w = w.value
+            self.tex_h = h.value
+            self.xy = array("f")
+            self.uv = array("f")
+            self.colors = array("B")
+        else:
+            self.src = array("i")
+            self.dest = array("i")
+
+    def clear(self):
+        self.count = 0
+        if self.geometry:
+            del self.xy[:]
+            del self.uv[:]
+            del self.colors[:]
+        else:
+            del self.src[:]
+            del self.dest[:]
+
+    def add(self, src, dest, tint):
+        if self.geometry:
+            x0 = float(dest[0])
+            y0 = float(dest[1])
+            x1 = x0 + dest[2]
+            y1 = y0 + dest[3]
+            self.xy.extend((x0, y0, x1, y0, x1, y1, x0, y1))
+
+            u0 = src[0] / self.tex_w
+            v0 = src[1] / self.tex_h
+            u1 = (src[0] + src[2]) / self.tex_w
+            v1 = (src[1] + src[3]) / self.tex_h
+            self.uv.extend((u0, v0, u1, v0, u1, v1, u0, v1))
+
+            self.colors.extend((tint or _OPAQUE_WHITE) * 4)
+        else:
+            self.src.extend(src)
+            self.dest.extend(dest)
+        self.count += 1
+
+    def add_many(self, count, src, dest, xy, uv, tint):
+        if self.geometry:
+            self.xy.frombytes(xy)
+            self.uv.frombytes(uv)
+            self.colors.frombytes(bytearray(tint or _OPAQUE_WHITE) * (4 * count))
+        else:
+            self.src.frombytes(src)
+            self.dest.frombytes(dest)
+        self.count += count
+
+    def submit(self, renderer_obj, indices):
+        texture = self.texture
+        renderer = renderer_obj.renderer
+
+        if self.geometry:
+            # the tint is in the colour of the vertices
+            renderer_obj._set_texture_state(texture, (255, 255, 255), 255)
+            vertices = self.count * 4
+            xy = (ctypes.c_float * len(self.xy)).from_buffer(self.xy)
+            uv = (ctypes.c_float * len(self.uv)).from_buffer(self.uv)
+            colors = (sdl2.SDL_Color * vertices).from_buffer(self.colors)
+            idx = (ctypes.c_int * (self.count * 6)).from_buffer(indices)
+            sdl2.SDL_RenderGeometryRaw(renderer, texture,
+                                       xy, 8,
+                                       colors, 4,
+                                       uv, 8,
+                                       vertices,
+                                       idx, self.count * 6, 4,
+                                       )
+            renderer_obj._texture_modulated(texture)
+            renderer_obj.copies += 1
+            # release the views so the arrays can be resized
+            del xy, uv, colors, idx
+            return
+
+        if self.tint:
+            renderer_obj._set_texture_state(texture, self.tint[:3], self.tint[3])
+        else:
+            renderer_obj._set_texture_state(texture)
+
+        src = (sdl2.SDL_Rect * self.count).from_buffer(self.src)
+        dest = (sdl2.SDL_Rect * self.count).from_buffer(self.dest)
+        render_copy = sdl2.SDL_RenderCopy
+        for i in range(self.count):
+            render_copy(renderer, texture, src[i], dest[i])
+        renderer_obj.copies += self.count
+        del src, dest
+
+_has_render_geometry = None
+
+def has_render_geometry():
+    """True if SDL2 supports SDL_RenderGeometryRaw (SDL 2.0.18 or later)"""
+    global _has_render_geometry
+
+    if _has_render_geometry is None:
+        _has_render_geometry = False
+        if hasattr(sdl2, "SDL_RenderGeometryRaw"):
+            ver = sdl2.SDL_version()
+            sdl2.SDL_GetVersion(ctypes.byref(ver))
+            _has_render_geometry = (ver.major, ver.minor, ver.patch) >= (2, 0, 18)
+    return _has_render_geometry
+
+def _check_tint(tint):
+    if isinstance(tint, tuple) and len(tint) == 4:
+        return tint
+    return None
+
+class SpriteBatch(object):
+    """
+    Batch of sprites to be drawn in one pass with Renderer.draw_batch
+
+    Parameters:
+
+        geometry: submit each texture with one SDL_RenderGeometryRaw call
+          (True), or SDL_RenderCopy per sprite (False). By default it is
+          used if supported by SDL2.
+
+    The sprites are grouped by texture (and by tint without geometry), so
+    the drawing order is only kept between sprites in the same group; the
+    groups are drawn in the order they were first added after the last
+    clear. The batch can be reused from frame to frame; the buffers of the
+    groups used in the last frame are kept allocated.
+    """
+    def __init__(self, geometry=None):
+        if geometry is None:
+            geometry = has_render_geometry()
+
+        self.geometry = geometry
+        self._groups = []
+        self._group_map = {}
+        self._indices = array("i")
+
+    def __len__(self):
+        return sum(group.count for group in self._groups)
+
+    def clear(self):
+        """Removes all the sprites from the batch"""
+        # keep only the groups used since the last clear
+        self._group_map = dict((group.key, group) for group in self._groups)
+        for group in self._groups:
+            group.clear()
+        self._groups = []
+
+    def add(self, texture, x=0, y=0, src_rect=None, dest_rect=None, tint=None):
+        """
+        Adds a sprite to the batch
+
+        Parameters:
+
+            texture: texture created with Harness.load_resource or Texture.get_texture.
+            x: horizontal location to draw the whole texture.
+            y: vertical location to draw the whole texture.
+            src_rect: tuple with the rect defining the section of the texture to draw.
+            dest_rect: tuple with the rect defining the section of the destination. If
+              this parameter is used, x and y are ignored.
+            tint: colour the texture, tuple with (r, g, b, alpha).
+        """
+        src = src_rect or texture.rect
+        if dest_rect is None:
+            dest_rect = (x, y, src[2], src[3])
+
+        tint = _check_tint(tint)
+        group = self._get_group(texture.texture, tint)
+        group.add(src, dest_rect, tint)
+
+        if self.geometry and group.count * 6 > len(self._indices):
+            self._grow_indices(group.count)
+
+    def _add_many(self, texture, tint, count, src=None, dest=None, xy=None, uv=None):
+        """
+        Adds sprites from bytes (eg, NumPy arrays converted with tobytes)
+
+        With geometry, xy and uv have the 4 vertices of each sprite as C
+        floats; otherwise src and dest have the rects as C ints.
+        """
+        if not count:
+            return
+
+        tint = _check_tint(tint)
+        group = self._get_group(texture, tint)
+        group.add_many(count, src, dest, xy, uv, tint)
+
+        if self.geometry and group.count * 6 > len(self._indices):
+            self._grow_indices(group.count)
+
+    def _get_group(self, texture, tint):
+        if self.geometry:
+            key = id(texture)
+        else:
+            key = (id(texture), tint)
+
+        group = self._group_map.get(key)
+        if group is None:
+            group = _BatchGroup(key, texture, None if self.geometry else tint, self.geometry)
+            self._group_map[key] = group
+            self._groups.append(group)
+        elif not group.count:
+            # first sprite since the last clear
+            self._groups.append(group)
+        return group
+
+    def _grow_indices(self, count):
+        size = max(count, 2 * len(self._indices) // 6, 64)
+        start = len(self._indices) // 6
+        for i in range(start, size):
+            base = i * 4
+            self._indices.extend((base, base + 1, base + 2, base, base + 2, base + 3))
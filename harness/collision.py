@@ -0,0 +1,186 @@
+"""
+Broad phase collision detection.
+
+Part of Harness for pysdl2, see harness/__init__.py for license details.
+"""
+
+class SpatialHash(object):
+    """
+    Uniform grid of rectangles to find the ones overlapping
+
+    Parameters:
+
+        cell_size: size in pixels of the cells of the grid; something around
+          the size of the most common objects works best (eg, a sprite).
+
+    The objects can be anything usable as dictionary key (eg, the actors or
+    their indexes in arrays), each with a rect of x, y, width and height (eg,
+    the size of its Texture). Only the cells covered by the rects are stored,
+    so the space has no limits.
+    """
+    def __init__(self, cell_size=64):
+        self.cell_size = cell_size
+        self._cells = {}
+        # object: [x, y, width, height, first cell x, first cell y, last cell x, last cell y]
+        self._objects = {}
+
+    def __len__(self):
+        return len(self._objects)
+
+    def __contains__(self, obj):
+        return obj in self._objects
+
+    def clear(self):
+        """Removes all the objects"""
+        self._cells.clear()
+        self._objects.clear()
+
+    def rect(self, obj):
+        """Returns the (x, y, width, height) of an object"""
+        return tuple(self._objects[obj][:4])
+
+    def _add_cells(self, obj, cx0, cy0, cx1, cy1):
+        cells = self._cells
+        for cy in range(cy0, cy1 + 1):
+            for cx in range(cx0, cx1 + 1):
+                cell = cells.get((cx, cy))
+                if cell is None:
+                    cells[(cx, cy)] = [obj]
+                else:
+                    cell.append(obj)
+
+    def _remove_cells(self, obj, cx0, cy0, cx1, cy1):
+        cells = self._cells
+        for cy in range(cy0, cy1 + 1):
+            for cx in range(cx0, cx1 + 1):
+                cell = cells[(cx, cy)]
+                cell.remove(obj)
+                if not cell:
+                    del cells[(cx, cy)]
+
+    def insert(self, obj, x, y, width, height):
+        """Adds an object, or moves it if it was already added"""
+        if obj in self._objects:
+            return self.move(obj, x, y, width, height)
+
+        size = self.cell_size
+        cx0 = int(x // size)
+        cy0 = int(y // size)
+        cx1 = int((x + width) // size)
+        cy1 = int((y + height) // size)
+        self._objects[obj] = [x, y, width, height, cx0, cy0, cx1, cy1]
+        self._add_cells(obj, cx0, cy0, cx1, cy1)
+
+    def insert_many(self, objs, xs, ys, widths, heights):
+        """Adds (or moves) several objects, taking their rects from sequences"""
+        insert = self.insert
+        for obj, x, y, width, height in zip(objs, xs, ys, widths, heights):
+            insert(obj, x, y, width, height)
+
+    def move(self, obj, x, y, width=None, height=None):
+        """
+        Moves an object
+
+        Parameters:
+
+            obj: the object.
+            x, y: new position.
+            width, height: new size (by default, the size doesn't change).
+
+        Only the cells that change are updated.
+        """
+        data = self._objects[obj]
+        if width is None:
+            width = data[2]
+        if height is None:
+            height = data[3]
+
+        size = self.cell_size
+        cx0 = int(x // size)
+        cy0 = int(y // size)
+        cx1 = int((x + width) // size)
+        cy1 = int((y + height) // size)
+
+        if (cx0, cy0, cx1, cy1) != (data[4], data[5], data[6], data[7]):
+            self._remove_cells(obj, data[4], data[5], data[6], data[7])
+            self._add_cells(obj, cx0, cy0, cx1, cy1)
+
+        data[:] = (x, y, width, height, cx0, cy0, cx1, cy1)
+
+    def remove(self, obj):
+        """Removes an object"""
+        data = self._objects.pop(obj)
+        self._remove_cells(obj, data[4], data[5], data[6], data[7])
+
+    def query(self, x, y, width, height):
+        """Returns a list with the objects overlapping a rect"""
+        size = self.cell_size
+        cells = self._cells
+        objects = self._objects
+        x1 = x + width
+        y1 = y + height
+
+        result = []
+        seen = set()
+        for cy in range(int(y // size), int(y1 // size) + 1):
+            for cx in range(int(x // size), int(x1 // size) + 1):
+                cell = cells.get((cx, cy))
+                if cell is None:
+                    continue
+                for obj in cell:
+                    if obj in seen:
+                        continue
+                    seen.add(obj)
+                    ox, oy, ow, oh = objects[obj][:4]
+                    if ox < x1 and x < ox + ow and oy < y1 and y < oy + oh:
+                        result.append(obj)
+        return result
+
+    def query_point(self, x, y):
+        """Returns a list with the objects containing a point"""
+        size = self.cell_size
+        cell = self._cells.get((int(x // size), int(y // size)))
+        if cell is None:
+            return []
+
+        objects = self._objects
+        result = []
+        for obj in cell:
+            ox, oy, ow, oh = objects[obj][:4]
+            if ox <= x < ox + ow and oy <= y < oy + oh:
+                result.append(obj)
+        return result
+
+    def colliding(self, obj):
+        """Returns a list with the objects overlapping an object"""
+        data = self._objects[obj]
+        return [other for other in self.query(*data[:4]) if other != obj]
+
+    def pairs(self):
+        """
+        Returns a list with all the pairs of objects overlapping
+
+        Each pair is a tuple with the two objects, and it is only included
+        once.
+        """
+        size = self.cell_size
+        objects = self._objects
+
+        result = []
+        for (cx, cy), cell in self._cells.items():
+            count = len(cell)
+            if count < 2:
+                continue
+
+            rects = [objects[obj] for obj in cell]
+            for i in range(count - 1):
+                ax, ay, aw, ah = rects[i][:4]
+                ax1 = ax + aw
+                ay1 = ay + ah
+                for j in range(i + 1, count):
+                    bx, by, bw, bh = rects[j][:4]
+                    if ax < bx + bw and bx < ax1 and ay < by + bh and by < ay1:
+                        # only in the cell with the top left corner of the overlap
+                        if int(max(ax, bx) // size) == cx and int(max(ay, by) // size) == cy:
+                            result.append((cell[i], cell[j]))
+        return result
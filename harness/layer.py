@@ -0,0 +1,78 @@
+"""
+Layers cached in render target textures.
+
+Part of Harness for pysdl2, see harness/__init__.py for license details.
+"""
+import sys
+
+try:
+    import sdl2
+except ImportError as ex:
+    if not hasattr(sys, "_gen_docs"):
+        sys.exit("SDL2 library not found: %s" % ex)
+
+_premultiplied = None
+
+def premultiplied_blend_mode():
+    """
+    Returns a blend mode for textures with premultiplied alpha, or None
+
+    The contents drawn with alpha blending into a transparent render target
+    have the alpha applied already.
+    """
+    global _premultiplied
+
+    if _premultiplied is None and hasattr(sdl2, "SDL_ComposeCustomBlendMode"):
+        _premultiplied = sdl2.SDL_ComposeCustomBlendMode(sdl2.SDL_BLENDFACTOR_ONE,
+                                                         sdl2.SDL_BLENDFACTOR_ONE_MINUS_SRC_ALPHA,
+                                                         sdl2.SDL_BLENDOPERATION_ADD,
+                                                         sdl2.SDL_BLENDFACTOR_ONE,
+                                                         sdl2.SDL_BLENDFACTOR_ONE_MINUS_SRC_ALPHA,
+                                                         sdl2.SDL_BLENDOPERATION_ADD,
+                                                         )
+    return _premultiplied
+
+class Layer(object):
+    """
+    Draw function cached in a texture
+
+    Use Harness.layer to create layers and Renderer.draw_layer to draw them.
+
+    The texture is drawn with a premultiplied alpha blend mode if the
+    renderer supports it (premultiplied is True), so the layer looks the same
+    as drawing its contents directly. Otherwise (eg, the software renderer)
+    alpha blending is used, and translucent contents look darker than drawn
+    directly (opaque and fully transparent pixels are exact).
+    """
+    def __init__(self, renderer, draw_fn, width, height):
+        self.draw_fn = draw_fn
+        self.width = width
+        self.height = height
+        self.dirty = True
+        self.texture = None
+        self.premultiplied = False
+
+        if sdl2.SDL_RenderTargetSupported(renderer):
+            texture = sdl2.SDL_CreateTexture(renderer,
+                                             sdl2.SDL_PIXELFORMAT_RGBA8888,
+                                             sdl2.SDL_TEXTUREACCESS_TARGET,
+                                             width,
+                                             height,
+                                             )
+            if texture:
+                mode = premultiplied_blend_mode()
+                if mode is not None and sdl2.SDL_SetTextureBlendMode(texture, mode) == 0:
+                    self.premultiplied = True
+                else:
+                    sdl2.SDL_SetTextureBlendMode(texture, sdl2.SDL_BLENDMODE_BLEND)
+                self.texture = texture
+
+    def invalidate(self):
+        """Marks the layer to be rendered again next time it is drawn"""
+        self.dirty = True
+
+    def free(self):
+        """Frees the layer texture"""
+        if self.texture:
+            sdl2.SDL_DestroyTexture(self.texture)
+            self.texture = None
@@ -0,0 +1,50 @@
+"""
+Resources loaded in the background.
+
+Part of Harness for pysdl2, see harness/__init__.py for license details.
+"""
+from __future__ import division
+
+class AsyncLoad(object):
+    """
+    Resources being loaded in the background
+
+    Use Harness.load_resources_async to create it. The loaded resources are
+    in the resources dictionary, and the error messages of the resources that
+    failed to load in the errors dictionary (both by file name).
+    """
+    def __init__(self, filenames, callback=None):
+        self.filenames = []
+        for filename in filenames:
+            if filename not in self.filenames:
+                self.filenames.append(filename)
+        self.callback = callback
+        self.resources = {}
+        self.errors = {}
+
+    def __getitem__(self, filename):
+        return self.resources[filename]
+
+    @property
+    def progress(self):
+        """Fraction of the resources loaded (from 0.0 to 1.0)"""
+        if not self.filenames:
+            return 1.0
+        return (len(self.resources) + len(self.errors)) / len(self.filenames)
+
+    @property
+    def done(self):
+        """True if all the resources have been processed"""
+        return len(self.resources) + len(self.errors) == len(self.filenames)
+
+    def _loaded(self, filename, resource):
+        self.resources[filename] = resource
+        self._check_done()
+
+    def _failed(self, filename, error):
+        self.errors[filename] = error
+        self._check_done()
+
+    def _check_done(self):
+        if self.done and self.callback:
+            self.callback(self)
@@ -0,0 +1,248 @@
+"""
+Particle systems using NumPy arrays.
+
+This module requires NumPy, and it is not imported by harness:
+
+    from harness.particles import ParticleSystem
+
+Part of Harness for pysdl2, see harness/__init__.py for license details.
+"""
+from __future__ import division
+import sys
+import ctypes
+import math
+
+try:
+    import sdl2
+except ImportError as ex:
+    if not hasattr(sys, "_gen_docs"):
+        sys.exit("SDL2 library not found: %s" % ex)
+
+try:
+    import numpy as np
+except ImportError as ex:
+    if not hasattr(sys, "_gen_docs"):
+        sys.exit("NumPy not found (required by harness.particles): %s" % ex)
+
+from .batch import has_render_geometry
+
+class ParticleSystem(object):
+    """
+    Particles stored in arrays, updated and drawn all at once
+
+    Parameters:
+
+        frames: list of Texture with the frames of the particles; all of them
+          must be from the same texture (eg, obtained with get_texture).
+        max_particles: maximum number of particles alive at the same time.
+        gravity: (x, y) acceleration in pixels per second squared.
+        tint: colour the particles, tuple with (r, g, b, alpha).
+        fade: fade out the particles as their life ends (requires
+          SDL_RenderGeometryRaw, SDL 2.0.18 or later).
+        seed: seed for the random numbers used by burst.
+
+    The position, velocity, remaining life and frame of the particles are in
+    the x, y, vx, vy, life and frame arrays; the first count elements are the
+    particles alive. Add update as an update function with Harness.update and
+    draw the particles with draw. Particles are centered on their position.
+    """
+    def __init__(self, frames, max_particles=4096, gravity=(0.0, 0.0), tint=None, fade=False, seed=None):
+        if not frames:
+            raise ValueError("at least one frame is required")
+        self.texture = frames[0].texture
+        for frame in frames:
+            if frame.texture is not self.texture:
+                raise ValueError("all the frames must be from the same texture")
+
+        self.max_particles = max_particles
+        self.gravity = gravity
+        self.tint = tint
+        self.fade = fade
+        self.rng = np.random.default_rng(seed)
+        self.count = 0
+
+        self.x = np.zeros(max_particles, dtype=np.float32)
+        self.y = np.zeros(max_particles, dtype=np.float32)
+        self.vx = np.zeros(max_particles, dtype=np.float32)
+        self.vy = np.zeros(max_particles, dtype=np.float32)
+        self.life = np.zeros(max_particles, dtype=np.float32)
+        self.frame = np.zeros(max_particles, dtype=np.int32)
+        self._start_life = np.ones(max_particles, dtype=np.float32)
+        self._arrays = (self.x, self.y, self.vx, self.vy, self.life, self.frame, self._start_life)
+
+        self._frames = frames
+        self._src = np.array([frame.rect for frame in frames], dtype=np.int32)
+        self._half_w = self._src[:, 2] / 2.0
+        self._half_h = self._src[:, 3] / 2.0
+
+        w, h = ctypes.c_int(), ctypes.c_int()
+        sdl2.SDL_QueryTexture(self.texture, None, None, ctypes.byref(w), ctypes.byref(h))
+        u0 = self._src[:, 0] / w.value
+        v0 = self._src[:, 1] / h.value
+        u1 = (self._src[:, 0] + self._src[:, 2]) / w.value
+        v1 = (self._src[:, 1] + self._src[:, 3]) / h.value
+        self._uv = np.stack((u0, v0, u1, v0, u1, v1, u0, v1), axis=1).astype(np.float32)
+
+        # vertices and indices of the quads for SDL_RenderGeometryRaw
+        self._xy = np.zeros((max_particles, 8), dtype=np.float32)
+        self._colors = np.zeros((max_particles, 4, 4), dtype=np.uint8)
+        base = np.arange(max_particles, dtype=np.int32)[:, None] * 4
+        self._indices = (base + np.array((0, 1, 2, 0, 2, 3), dtype=np.int32)).ravel()
+
+        self._dest = np.zeros((max_particles, 4), dtype=np.int32)
+
+    def __len__(self):
+        return self.count
+
+    def clear(self):
+        """Removes all the particles"""
+        self.count = 0
+
+    def emit(self, x, y, vx=0.0, vy=0.0, life=1.0, frame=0, count=1):
+        """
+        Adds particles
+
+        Parameters:
+
+            x, y: position.
+            vx, vy: velocity in pixels per second.
+            life: time to live in seconds.
+            frame: index in the list of frames.
+            count: number of particles to add.
+
+        Each parameter can be a number or an array with count values. Returns
+        the number of particles added (limited by max_particles).
+        """
+        count = min(count, self.max_particles - self.count)
+        if count <= 0:
+            return 0
+
+        start = self.count
+        end = start + count
+        for array, value in ((self.x, x), (self.y, y), (self.vx, vx), (self.vy, vy),
+                             (self.life, life), (self.frame, frame), (self._start_life, life)):
+            value = np.asarray(value)
+            array[start:end] = value[:count] if value.ndim else value
+
+        self.count = end
+        return count
+
+    def burst(self, x, y, count, speed=60.0, life=1.0, frames=None, angle=0.0, spread=2 * math.pi):
+        """
+        Adds particles moving away from a point
+
+        Parameters:
+
+            x, y: position.
+            count: number of particles to add.
+            speed: maximum speed in pixels per second (at least half of it).
+            life: maximum time to live in seconds (at least half of it).
+            frames: list of frame indexes to pick from (defaults to all).
+            angle: direction in radians of the center of the burst.
+            spread: angle in radians covered by the burst.
+        """
+        rng = self.rng
+        angles = angle + (rng.random(count) - 0.5) * spread
+        speeds = speed * (0.5 + 0.5 * rng.random(count))
+        lives = life * (0.5 + 0.5 * rng.random(count))
+        if frames is None:
+            frames = len(self._frames)
+        frame = rng.choice(frames, count)
+
+        return self.emit(x, y, np.cos(angles) * speeds, np.sin(angles) * speeds, lives, frame, count)
+
+    def update(self, dt):
+        """Moves the particles and removes the ones with no life left"""
+        count = self.count
+        if not count:
+            return
+
+        vx = self.vx[:count]
+        vy = self.vy[:count]
+        if self.gravity[0]:
+            vx += self.gravity[0] * dt
+        if self.gravity[1]:
+            vy += self.gravity[1] * dt
+        self.x[:count] += vx * dt
+        self.y[:count] += vy * dt
+
+        life = self.life[:count]
+        life -= dt
+
+        alive = life > 0
+        if not alive.all():
+            keep = np.flatnonzero(alive)
+            for array in self._arrays:
+                array[:len(keep)] = array[keep]
+            self.count = len(keep)
+
+    def draw(self, renderer):
+        """
+        Draws the particles
+
+        Parameters:
+
+            renderer: the renderer provided to the draw functions.
+
+        All the particles are drawn with one SDL_RenderGeometryRaw call if
+        supported by SDL2, or one SDL_RenderCopy per particle otherwise.
+        """
+        count = self.count
+        if not count:
+            return
+
+        frame = self.frame[:count]
+        x0 = self.x[:count] - self._half_w[frame]
+        y0 = self.y[:count] - self._half_h[frame]
+        x1 = x0 + self._src[frame, 2]
+        y1 = y0 + self._src[frame, 3]
+        tint = self.tint or (255, 255, 255, 255)
+
+        if not has_render_geometry():
+            renderer._set_texture_state(self.texture, tint[:3], tint[3])
+
+            dest = self._dest[:count]
+            dest[:, 0] = x0
+            dest[:, 1] = y0
+            dest[:, 2] = self._src[frame, 2]
+            dest[:, 3] = self._src[frame, 3]
+            src = np.ascontiguousarray(self._src[frame])
+
+            src_rects = (sdl2.SDL_Rect * count).from_buffer(src)
+            dest_rects = (sdl2.SDL_Rect * count).from_buffer(self._dest)
+            render_copy = sdl2.SDL_RenderCopy
+            for i in range(count):
+                render_copy(renderer.renderer, self.texture, src_rects[i], dest_rects[i])
+            renderer.copies += count
+            del src_rects, dest_rects
+            return
+
+        # the tint is in the colour of the vertices
+        renderer._set_texture_state(self.texture, (255, 255, 255), 255)
+
+        xy = self._xy[:count]
+        xy[:, 0] = x0
+        xy[:, 1] = y0
+        xy[:, 2] = x1
+        xy[:, 3] = y0
+        xy[:, 4] = x1
+        xy[:, 5] = y1
+        xy[:, 6] = x0
+        xy[:, 7] = y1
+        uv = np.ascontiguousarray(self._uv[frame])
+
+        colors = self._colors[:count]
+        colors[:] = tint
+        if self.fade:
+            alpha = np.clip(self.life[:count] / self._start_life[:count], 0.0, 1.0) * tint[3]
+            colors[:, :, 3] = alpha[:, None]
+
+        sdl2.SDL_RenderGeometryRaw(renderer.renderer, self.texture,
+                                   xy.ctypes.data_as(ctypes.POINTER(ctypes.c_float)), 8,
+                                   colors.ctypes.data_as(ctypes.POINTER(sdl2.SDL_Color)), 4,
+                                   uv.ctypes.data_as(ctypes.POINTER(ctypes.c_float)), 8,
+                                   count * 4,
+                                   self._indices.ctypes.data_as(ctypes.c_void_p), count * 6, 4,
+                                   )
+        renderer._texture_modulated(self.texture)
+        renderer.copies += 1
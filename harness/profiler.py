@@ -0,0 +1,240 @@
+"""
+Frame profiler for Harness.
+
+Part of Harness for pysdl2, see harness/__init__.py for license details.
+"""
+from __future__ import division
+import json
+from timeit import default_timer as timer
+
+class _Timing(object):
+    """Accumulated timing of a measure"""
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, elapsed):
+        self.calls += 1
+        self.total += elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+
+    def as_dict(self):
+        return dict(calls=self.calls,
+                    total_ms=self.total * 1000,
+                    avg_ms=self.total * 1000 / self.calls if self.calls else 0.0,
+                    max_ms=self.max * 1000,
+                    )
+
+class Profiler(object):
+    """
+    Records where the frame time goes
+
+    Use Harness.enable_profiler to create it.
+
+    Parameters:
+
+        font: BitmapFont to draw the overlay (if None, no overlay is drawn).
+        dump: file name to save the results when the game ends (.json or .csv).
+        renderer: Renderer to count its render copies.
+
+    The measures are the time per update and draw handler, the updates per
+    frame, the SDL render copies per frame made by the renderer (including
+    batches, tile maps and particles), the time spent presenting the
+    frame (including the wait for vsync) and a histogram of the frame time
+    (in HISTOGRAM_BUCKETS buckets of 1 ms, the last one for longer frames).
+    """
+    HISTOGRAM_BUCKETS = 50
+
+    def __init__(self, font=None, dump=None, renderer=None):
+        self.font = font
+        self.dump_filename = dump
+        self.renderer = renderer
+        self.overlay_lines = []
+        self.reset()
+
+        self._counting = False
+
+    def reset(self):
+        """Resets all the measures"""
+        self.frames = 0
+        self.handlers = {}
+        self._names = {}
+        self.updates = _Timing()
+        self.copies = _Timing()
+        self.present = _Timing()
+        self.frame_time = _Timing()
+        self.histogram = [0] * self.HISTOGRAM_BUCKETS
+
+        self._copies_mark = self.renderer.copies if self.renderer else 0
+        self._overlay_copies = 0
+        self._last_frame = None
+        self._window = None
+        self._window_start = None
+
+    def start(self):
+        """Starts counting the render copies"""
+        if not self._counting and self.renderer:
+            self._counting = True
+            self._copies_mark = self.renderer.copies
+
+    def stop(self):
+        """Stops counting the render copies"""
+        self._counting = False
+
+    def add_handler(self, kind, fn, elapsed):
+        key = (kind, fn)
+        timing = self.handlers.get(key)
+        if timing is None:
+            timing = self.handlers[key] = _Timing()
+            self._add_name(key)
+        timing.add(elapsed)
+
+    def add_updates(self, count):
+        # the value is the number of updates
+        self.updates.add(count)
+
+    def add_present(self, elapsed):
+        self.present.add(elapsed)
+
+    def end_frame(self):
+        """Called once per frame after presenting it"""
+        now = timer()
+
+        if self._counting:
+            copies = self.renderer.copies
+            self.copies.add(copies - self._copies_mark - self._overlay_copies)
+            self._copies_mark = copies
+        self._overlay_copies = 0
+
+        if self._last_frame is not None:
+            elapsed = now - self._last_frame
+            self.frame_time.add(elapsed)
+            bucket = min(int(elapsed * 1000), self.HISTOGRAM_BUCKETS - 1)
+            self.histogram[bucket] += 1
+        self._last_frame = now
+        self.frames += 1
+
+        if self.font:
+            self._update_overlay(now)
+
+    def _update_overlay(self, now):
+        if self._window_start is None:
+            self._window_start = now
+            self._window = self._snapshot()
+            return
+
+        if now - self._window_start < 1.0:
+            return
+
+        prev = self._window
+        current = self._snapshot()
+        frames = current["frames"] - prev["frames"] or 1
+
+        def avg(name):
+            calls = current[name][0] - prev[name][0]
+            return (current[name][1] - prev[name][1]) / calls if calls else 0.0
+
+        lines = ["fps %i frame %.2fms present %.2fms" % (round(frames / (now - self._window_start)),
+                                                        avg("frame_time") * 1000,
+                                                        avg("present") * 1000,
+                                                        ),
+                 "updates %.2f copies %i" % (avg("updates"), round(avg("copies"))),
+                 ]
+        for key, timing in current["handlers"].items():
+            prev_timing = prev["handlers"].get(key, (0, 0.0))
+            calls = timing[0] - prev_timing[0]
+            if calls:
+                lines.append("%s %.2fms" % (self._handler_name(key), (timing[1] - prev_timing[1]) * 1000 / frames))
+
+        self.overlay_lines = lines
+        self._window = current
+        self._window_start = now
+
+    def _snapshot(self):
+        snapshot = dict(frames=self.frames,
+                        handlers=dict((key, (timing.calls, timing.total))
+                                      for key, timing in self.handlers.items()),
+                        )
+        for name in ("updates", "copies", "present", "frame_time"):
+            timing = getattr(self, name)
+            snapshot[name] = (timing.calls, timing.total)
+        return snapshot
+
+    def _add_name(self, key):
+        # handlers with the same name (eg, methods of different instances)
+        # get a suffix with their index
+        kind, fn = key
+        base = "%s:%s" % (kind, getattr(fn, "__qualname__", getattr(fn, "__name__", repr(fn))))
+        name = base
+        names = set(self._names.values())
+        index = 1
+        while name in names:
+            index += 1
+            name = "%s#%i" % (base, index)
+        self._names[key] = name
+
+    def _handler_name(self, key):
+        return self._names[key]
+
+    def draw_overlay(self, renderer):
+        """Draws the overlay with the measures of the last second"""
+        if not self.font:
+            return
+
+        # the overlay is not part of the measures; the lines change every
+        # second, so they are not cached to keep the text cache for the game
+        copies = renderer.copies
+        for i, line in enumerate(self.overlay_lines):
+            renderer.draw_text(self.font, 2, 2 + i * self.font.height, line, cache=False)
+        self._overlay_copies += renderer.copies - copies
+
+    def stats(self):
+        """Returns a dictionary with all the measures"""
+        return dict(frames=self.frames,
+                    handlers=dict((self._handler_name(key), timing.as_dict())
+                                  for key, timing in self.handlers.items()),
+                    updates_per_frame=dict(avg=self.updates.total / self.updates.calls if self.updates.calls else 0.0,
+                                           max=self.updates.max,
+                                           ),
+                    copies_per_frame=dict(avg=self.copies.total / self.copies.calls if self.copies.calls else 0.0,
+                                          max=self.copies.max,
+                                          ),
+                    present=self.present.as_dict(),
+                    frame_time=self.frame_time.as_dict(),
+                    frame_time_histogram=list(self.histogram),
+                    )
+
+    def dump(self, filename=None):
+        """
+        Saves the measures
+
+        Parameters:
+
+            filename: file to save to, in CSV format if the name ends in .csv
+              or JSON otherwise (defaults to the dump file name provided when
+              the profiler was created).
+        """
+        filename = filename or self.dump_filename
+        if not filename:
+            return
+
+        stats = self.stats()
+
+        if not filename.endswith(".csv"):
+            with open(filename, "w") as fd:
+                json.dump(stats, fd, indent=2, sort_keys=True)
+            return
+
+        with open(filename, "w") as fd:
+            fd.write("measure,calls,total_ms,avg_ms,max_ms\n")
+            rows = sorted(stats["handlers"].items())
+            rows += [("present", stats["present"]), ("frame_time", stats["frame_time"])]
+            for name, timing in rows:
+                fd.write("%s,%i,%.4f,%.4f,%.4f\n" % (name, timing["calls"], timing["total_ms"],
+                                                     timing["avg_ms"], timing["max_ms"]))
+            for name in ("updates_per_frame", "copies_per_frame"):
+                fd.write("%s,%i,,%.4f,%.4f\n" % (name, stats["frames"], stats[name]["avg"], stats[name]["max"]))
+            for ms, count in enumerate(stats["frame_time_histogram"]):
+                fd.write("frame_time_hist_%ims,%i,,,\n" % (ms, count))
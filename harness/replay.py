@@ -0,0 +1,176 @@
+"""
+Recording and replay of the input consumed by the game updates.
+
+The log starts with a header (magic, version, updates per second and number
+of keys), followed by records for the updates where the keys changed:
+
+    varint: updates since the previous record
+    varint: number of changes
+    changes: key (uint16) and state (uint8)
+
+A record with no changes marks the end of the log. A log without it (eg,
+the game crashed while recording) is replayed up to its last complete
+record.
+
+Part of Harness for pysdl2, see harness/__init__.py for license details.
+"""
+import ctypes
+import struct
+
+MAGIC = b"HREC"
+VERSION = 1
+
+# magic, version, updates per second, number of keys
+HEADER = struct.Struct("<4sIdI")
+CHANGE = struct.Struct("<HB")
+
+def _write_varint(fd, value):
+    data = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            data.append(byte | 0x80)
+        else:
+            data.append(byte)
+            break
+    fd.write(bytes(data))
+
+def _read(fd, size):
+    data = fd.read(size)
+    if len(data) != size:
+        raise EOFError("Unexpected end of the replay log")
+    return data
+
+def _read_varint(fd):
+    value = 0
+    shift = 0
+    while True:
+        byte = fd.read(1)
+        if not byte:
+            raise EOFError("Unexpected end of the replay log")
+        byte = ord(byte)
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value
+        shift += 7
+
+class Recorder(object):
+    """
+    Records the state of the keys in each update
+
+    Use Harness.start_recording to create it.
+    """
+    def __init__(self, filename, ufps, num_keys):
+        self.filename = filename
+        self.num_keys = num_keys
+        self.updates = 0
+
+        self._fd = open(filename, "wb")
+        self._fd.write(HEADER.pack(MAGIC, VERSION, ufps, num_keys))
+        self._previous = b"\0" * num_keys
+        self._last_record = 0
+
+    def record(self, keys):
+        """Records the state of the keys for one update"""
+        state = ctypes.string_at(keys, self.num_keys)
+        if state != self._previous:
+            previous = self._previous
+            changes = [i for i in range(self.num_keys) if state[i:i + 1] != previous[i:i + 1]]
+
+            _write_varint(self._fd, self.updates - self._last_record)
+            _write_varint(self._fd, len(changes))
+            for i in changes:
+                self._fd.write(CHANGE.pack(i, ord(state[i:i + 1])))
+
+            self._previous = state
+            self._last_record = self.updates
+
+        self.updates += 1
+
+    def close(self):
+        """Ends the log"""
+        if self._fd:
+            _write_varint(self._fd, self.updates - self._last_record)
+            _write_varint(self._fd, 0)
+            self._fd.close()
+            self._fd = None
+
+class Replayer(object):
+    """
+    Replays the state of the keys recorded by Recorder
+
+    Use Harness.start_replay to create it.
+    """
+    def __init__(self, filename, ufps, num_keys):
+        self.filename = filename
+        self.num_keys = num_keys
+        self.updates = 0
+        self.done = False
+        # the log ended without the end marker
+        self.truncated = False
+
+        self._fd = open(filename, "rb")
+        header = self._fd.read(HEADER.size)
+        if len(header) != HEADER.size:
+            self._fd.close()
+            raise ValueError("%r is not a supported replay log" % filename)
+        magic, version, log_ufps, log_keys = HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION:
+            self._fd.close()
+            raise ValueError("%r is not a supported replay log" % filename)
+        if log_ufps != ufps or log_keys != num_keys:
+            self._fd.close()
+            raise ValueError("%r was recorded with %r updates per second and %i keys" % (filename, log_ufps, log_keys))
+
+        self._state = (ctypes.c_uint8 * num_keys)()
+        self._changes = None
+        self._read_record()
+
+    def _read_record(self):
+        try:
+            next_record = self.updates + _read_varint(self._fd)
+            count = _read_varint(self._fd)
+            changes = [CHANGE.unpack(_read(self._fd, CHANGE.size)) for i in range(count)]
+        except EOFError:
+            # end the log after the update of the last record
+            self.truncated = True
+            next_record = self.updates + (1 if self._changes else 0)
+            changes = []
+
+        self._next_record = next_record
+        self._changes = changes or None
+
+    @property
+    def at_end(self):
+        """True if all the recorded updates have been replayed"""
+        return self.done or (self._changes is None and self.updates == self._next_record)
+
+    def apply(self, keys):
+        """
+        Sets the state of the keys for one update
+
+        Returns False if the log has ended.
+        """
+        if self.done:
+            return False
+
+        while self.updates == self._next_record:
+            if self._changes is None:
+                self.close()
+                return False
+
+            for key, value in self._changes:
+                self._state[key] = value
+            self._read_record()
+
+        ctypes.memmove(keys, self._state, self.num_keys)
+        self.updates += 1
+        return True
+
+    def close(self):
+        """Closes the log"""
+        self.done = True
+        if self._fd:
+            self._fd.close()
+            self._fd = None
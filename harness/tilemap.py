@@ -0,0 +1,167 @@
+"""
+Tile maps drawn in cached chunks.
+
+Part of Harness for pysdl2, see harness/__init__.py for license details.
+"""
+import sys
+from array import array
+from collections import OrderedDict
+
+try:
+    import sdl2
+except ImportError as ex:
+    if not hasattr(sys, "_gen_docs"):
+        sys.exit("SDL2 library not found: %s" % ex)
+
+class Tilemap(object):
+    """
+    Tile map drawn in cached chunks
+
+    Parameters:
+
+        tileset: texture with the tiles, in rows from left to right.
+        tile_width: width of a tile.
+        tile_height: height of a tile.
+        width: width of the map in tiles.
+        height: height of the map in tiles.
+        data: optional sequence with the initial tiles (width * height
+          elements, by rows). Use -1 for empty cells.
+        chunk_size: size in tiles of the square chunks of the map.
+        max_chunks: maximum number of chunks kept in textures (the least
+          recently drawn are freed first).
+
+    The map is stored in a compact array, and it is drawn in chunks with
+    Renderer.draw_tilemap. A chunk is rendered into a texture the first time
+    it is visible and it is rendered again only if its cells change.
+    """
+    CHUNK_SIZE = 16
+    MAX_CHUNKS = 64
+
+    def __init__(self, tileset, tile_width, tile_height, width, height, data=None,
+                 chunk_size=None, max_chunks=None):
+        self.tileset = tileset
+        self.tile_width = tile_width
+        self.tile_height = tile_height
+        self.width = width
+        self.height = height
+        self.chunk_size = chunk_size or self.CHUNK_SIZE
+        self.max_chunks = max_chunks or self.MAX_CHUNKS
+
+        self.pixel_width = width * tile_width
+        self.pixel_height = height * tile_height
+        self.chunks_w = (width + self.chunk_size - 1) // self.chunk_size
+        self.chunks_h = (height + self.chunk_size - 1) // self.chunk_size
+
+        if data is None:
+            self.data = array("h", [-1]) * (width * height)
+        else:
+            self.data = array("h", data)
+            if len(self.data) != width * height:
+                raise ValueError("data must have %i elements" % (width * height))
+
+        cols = tileset.width // tile_width
+        rows = tileset.height // tile_height
+        self.tiles = [sdl2.SDL_Rect(tileset.rect[0] + (i % cols) * tile_width,
+                                    tileset.rect[1] + (i // cols) * tile_height,
+                                    tile_width,
+                                    tile_height,
+                                    ) for i in range(cols * rows)]
+
+        self._chunks = OrderedDict()
+        self._dirty = set()
+        # renderer that created the chunks
+        self._renderer = None
+
+    def get_tile(self, x, y):
+        """Returns the tile in a cell of the map"""
+        return self.data[x + y * self.width]
+
+    def set_tile(self, x, y, tile):
+        """
+        Sets the tile in a cell of the map
+
+        Parameters:
+
+            x: horizontal position in tiles.
+            y: vertical position in tiles.
+            tile: index of the tile in the tileset, or -1 for an empty cell.
+        """
+        index = x + y * self.width
+        if self.data[index] != tile:
+            self.data[index] = tile
+            self._dirty.add((x // self.chunk_size, y // self.chunk_size))
+
+    def invalidate(self):
+        """Marks all the chunks to be rendered again"""
+        self._dirty.update(self._chunks.keys())
+
+    def free(self):
+        """Frees the textures of all the chunks"""
+        for chunk in self._chunks.values():
+            self._renderer.reset_texture_state(chunk)
+            sdl2.SDL_DestroyTexture(chunk)
+        self._chunks.clear()
+        self._dirty.clear()
+
+    def _render_chunk(self, renderer, cx, cy, x, y):
+        tileset = self.tileset.texture
+        tiles = self.tiles
+        data = self.data
+        render_copy = sdl2.SDL_RenderCopy
+
+        renderer._set_texture_state(tileset)
+        dest = sdl2.SDL_Rect(0, 0, self.tile_width, self.tile_height)
+        start_x = cx * self.chunk_size
+        end_x = min(start_x + self.chunk_size, self.width)
+        start_y = cy * self.chunk_size
+        end_y = min(start_y + self.chunk_size, self.height)
+
+        copies = 0
+        for row in range(start_y, end_y):
+            dest.y = y + (row - start_y) * self.tile_height
+            offset = row * self.width
+            for col in range(start_x, end_x):
+                tile = data[offset + col]
+                if tile < 0:
+                    continue
+                dest.x = x + (col - start_x) * self.tile_width
+                render_copy(renderer.renderer, tileset, tiles[tile], dest)
+                copies += 1
+        renderer.copies += copies
+
+    def _get_chunk(self, renderer, cx, cy):
+        key = (cx, cy)
+        chunk = self._chunks.pop(key, None)
+
+        if chunk is None:
+            if not sdl2.SDL_RenderTargetSupported(renderer.renderer):
+                return None
+
+            chunk = sdl2.SDL_CreateTexture(renderer.renderer,
+                                           sdl2.SDL_PIXELFORMAT_RGBA8888,
+                                           sdl2.SDL_TEXTUREACCESS_TARGET,
+                                           self.chunk_size * self.tile_width,
+                                           self.chunk_size * self.tile_height,
+                                           )
+            if not chunk:
+                return None
+
+            sdl2.SDL_SetTextureBlendMode(chunk, sdl2.SDL_BLENDMODE_BLEND)
+            self._dirty.add(key)
+            renderer._tilemaps.add(self)
+            self._renderer = renderer
+
+            while len(self._chunks) >= max(self.max_chunks, 1):
+                old_key, old_chunk = self._chunks.popitem(last=False)
+                renderer.reset_texture_state(old_chunk)
+                sdl2.SDL_DestroyTexture(old_chunk)
+                self._dirty.discard(old_key)
+
+        if key in self._dirty:
+            target = renderer._begin_target(chunk)
+            self._render_chunk(renderer, cx, cy, 0, 0)
+            sdl2.SDL_SetRenderTarget(renderer.renderer, target)
+            self._dirty.discard(key)
+
+        self._chunks[key] = chunk
+        return chunk
@@ -0,0 +1,115 @@
+"""
+Voice management for audio samples.
+
+Part of Harness for pysdl2, see harness/__init__.py for license details.
+"""
+import sys
+import ctypes
+
+try:
+    from sdl2 import sdlmixer
+except ImportError as ex:
+    if not hasattr(sys, "_gen_docs"):
+        sys.exit("SDL2_Mixer library not found: %s" % ex)
+
+class _Voice(object):
+    """A sample playing in a channel"""
+    def __init__(self, sample, priority, serial):
+        self.sample = sample
+        self.priority = priority
+        self.serial = serial
+
+class VoicePool(object):
+    """
+    Assigns SDL_mixer channels to the samples played
+
+    Use Harness.play to play samples.
+
+    Parameters:
+
+        channels: number of channels to allocate initially.
+        max_channels: maximum number of channels.
+
+    When all the channels are busy more are allocated, up to max_channels.
+    After that, the oldest sample with the lowest priority is stopped to
+    play the new one, unless all the samples playing have higher priority
+    than the new one (then the new one is not played).
+    """
+    def __init__(self, channels, max_channels):
+        self.max_channels = max(channels, max_channels)
+        self.voices = []
+        self._serial = 0
+        self._allocate(channels)
+
+    def _allocate(self, channels):
+        self.channels = sdlmixer.Mix_AllocateChannels(channels)
+        self.voices.extend([None] * (self.channels - len(self.voices)))
+
+    def play(self, sample, loops=0, priority=0, limit=None):
+        """
+        Plays a sample
+
+        Parameters:
+
+            sample: sample to play.
+            loops: number of times to repeat the sample (-1 for infinite loop).
+            priority: higher priority samples can stop lower priority ones.
+            limit: maximum number of instances of the sample playing at the
+              same time; the oldest one is stopped to play the new one (with
+              0 the sample is not played).
+
+        Returns the channel used, or -1 if the sample couldn't be played.
+        """
+        if limit is not None and limit <= 0:
+            return -1
+
+        key = ctypes.addressof(sample.contents)
+        voices = self.voices
+
+        free = None
+        lowest = None
+        same = []
+        for channel, voice in enumerate(voices):
+            if voice is None or not sdlmixer.Mix_Playing(channel):
+                voices[channel] = None
+                if free is None:
+                    free = channel
+                continue
+
+            if voice.sample == key:
+                same.append(channel)
+            if lowest is None or (voice.priority, voice.serial) < (voices[lowest].priority, voices[lowest].serial):
+                lowest = channel
+
+        if limit is not None and len(same) >= limit:
+            channel = min(same, key=lambda channel: voices[channel].serial)
+        elif free is not None:
+            channel = free
+        elif self.channels < self.max_channels:
+            channel = self.channels
+            self._allocate(min(self.channels * 2, self.max_channels))
+        elif lowest is not None and voices[lowest].priority <= priority:
+            channel = lowest
+        else:
+            return -1
+
+        if voices[channel] is not None:
+            sdlmixer.Mix_HaltChannel(channel)
+
+        channel = sdlmixer.Mix_PlayChannel(channel, sample, loops)
+        if channel >= 0:
+            self._serial += 1
+            voices[channel] = _Voice(key, priority, self._serial)
+        return channel
+
+    def stop(self, channel=-1):
+        """Stops a channel, or all the channels with -1"""
+        if channel == -1:
+            self.voices = [None] * len(self.voices)
+        elif 0 <= channel < len(self.voices):
+            self.voices[channel] = None
+        return sdlmixer.Mix_HaltChannel(channel)
+
+    def playing(self):
+        """Returns the number of channels playing"""
+        return sdlmixer.Mix_Playing(-1)
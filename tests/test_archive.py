@@ -0,0 +1,92 @@
+"""
+Tests for the packed resource archives (harness.archive).
+"""
+import os
+import ctypes
+import shutil
+import tempfile
+import unittest
+
+import sdl2
+
+from harness import Harness
+from harness.archive import Archive, HEADER, pack
+
+FILES = {"a.txt": b"first file",
+         "empty.bin": b"",
+         "sub/b.dat": bytes(bytearray(range(256))) * 4,
+         }
+
+class ArchiveTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "data")
+        for name, data in FILES.items():
+            full_path = os.path.join(self.path, *name.split("/"))
+            if not os.path.isdir(os.path.dirname(full_path)):
+                os.makedirs(os.path.dirname(full_path))
+            with open(full_path, "wb") as fd:
+                fd.write(data)
+        self.filename = os.path.join(self.tmp_dir, "data.pak")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_round_trip(self):
+        index = pack(self.path, self.filename)
+        self.assertEqual(sorted(index), sorted(FILES))
+
+        archive = Archive(self.filename)
+        try:
+            self.assertEqual(sorted(archive.index), sorted(FILES))
+            for name, data in FILES.items():
+                self.assertIn(name, archive)
+                self.assertEqual(archive.read(name), data)
+            self.assertNotIn("missing.txt", archive)
+        finally:
+            archive.close()
+
+    def test_open_rw(self):
+        pack(self.path, self.filename)
+
+        archive = Archive(self.filename)
+        try:
+            data = FILES["sub/b.dat"]
+            rw = archive.open_rw("sub/b.dat")
+            self.assertEqual(sdl2.SDL_RWsize(rw), len(data))
+
+            buf = ctypes.create_string_buffer(len(data))
+            self.assertEqual(sdl2.SDL_RWread(rw, buf, 1, len(data)), len(data))
+            self.assertEqual(buf.raw, data)
+            sdl2.SDL_RWclose(rw)
+        finally:
+            archive.close()
+
+    def test_archive_in_path(self):
+        # the archive being created is not packed
+        self.filename = os.path.join(self.path, "data.pak")
+        self.assertEqual(sorted(pack(self.path, self.filename)), sorted(FILES))
+
+    def test_not_archive(self):
+        with open(self.filename, "wb") as fd:
+            fd.write(HEADER.pack(b"NOPE", 1, 0, 0))
+        self.assertRaises(ValueError, Archive, self.filename)
+
+    def test_load_resource(self):
+        pack(self.path, self.filename)
+
+        game = Harness(width=64, height=64, headless=True)
+        try:
+            game.resource_path = [self.tmp_dir]
+            archive = game.add_archive("data.pak")
+            self.assertIs(game.resource_path[0], archive)
+
+            fd = game.load_resource("sub/b.dat")
+            self.assertEqual(fd.read(), FILES["sub/b.dat"])
+            fd.close()
+        finally:
+            game.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+"""
+Tests for the rectangle packing of the texture atlases (harness.atlas).
+"""
+import random
+import unittest
+
+from harness.atlas import pack
+
+class PackTestCase(unittest.TestCase):
+
+    def check(self, sizes, max_width, max_height, padding=0):
+        """Packs and checks the result, returns the pages and positions"""
+        pages, positions = pack(sizes, max_width, max_height, padding)
+        self.assertEqual(len(positions), len(sizes))
+
+        rects = []
+        for (width, height), (page, x, y) in zip(sizes, positions):
+            page_width, page_height = pages[page]
+            self.assertTrue(0 <= x and x + width <= page_width)
+            self.assertTrue(0 <= y and y + height <= page_height)
+            self.assertTrue(page_width <= max_width and page_height <= max_height)
+            rects.append((page, x, y, width, height))
+
+        # no overlaps, including the padding
+        for i, (page, x, y, width, height) in enumerate(rects):
+            for other_page, ox, oy, other_width, other_height in rects[i + 1:]:
+                if page != other_page:
+                    continue
+                self.assertFalse(x < ox + other_width + padding and ox < x + width + padding and
+                                 y < oy + other_height + padding and oy < y + height + padding)
+
+        return pages, positions
+
+    def test_empty(self):
+        self.assertEqual(pack([], 64, 64), ([], []))
+
+    def test_one(self):
+        self.assertEqual(pack([(10, 20)], 64, 64, padding=1), ([(10, 20)], [(0, 0, 0)]))
+
+    def test_same_size(self):
+        pages, positions = self.check([(16, 16)] * 16, 64, 64)
+        self.assertEqual(pages, [(64, 64)])
+
+    def test_padding(self):
+        pages, positions = self.check([(16, 16)] * 4, 70, 70, padding=2)
+        self.assertEqual(pages, [(70, 16)])
+        self.assertEqual(sorted(x for page, x, y in positions), [0, 18, 36, 54])
+
+        # the padding doesn't fit
+        pages, positions = self.check([(16, 16)] * 4, 69, 69, padding=2)
+        self.assertEqual(pages, [(52, 34)])
+
+    def test_pages(self):
+        pages, positions = self.check([(32, 32)] * 5, 64, 64)
+        self.assertEqual(len(pages), 2)
+        self.assertEqual(sorted(page for page, x, y in positions), [0, 0, 0, 0, 1])
+
+    def test_too_big(self):
+        self.assertRaises(ValueError, pack, [(10, 10), (65, 10)], 64, 64)
+        self.assertRaises(ValueError, pack, [(10, 65)], 64, 64)
+
+    def test_random(self):
+        rng = random.Random(42)
+        for i in range(20):
+            sizes = [(rng.randint(1, 100), rng.randint(1, 100)) for j in range(rng.randint(1, 60))]
+            self.check(sizes, 256, 256, padding=rng.randint(0, 2))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+"""
+Tests for the grouping and drawing order of the sprite batches (headless).
+"""
+import ctypes
+import unittest
+
+import sdl2
+
+from harness import Harness, SpriteBatch, Texture, has_render_geometry
+
+RED = (255, 0, 0, 255)
+GREEN = (0, 255, 0, 255)
+
+class BatchTestCase(unittest.TestCase):
+
+    geometry = False
+
+    def setUp(self):
+        if self.geometry and not has_render_geometry():
+            self.skipTest("SDL_RenderGeometryRaw is not supported")
+
+        self.game = Harness(width=64, height=64, headless=True)
+        self.renderer = self.game.renderer_obj
+        self.red = self.texture(RED)
+        self.green = self.texture(GREEN)
+        self.batch = SpriteBatch(geometry=self.geometry)
+
+    def tearDown(self):
+        for texture in (self.red, self.green):
+            self.renderer.reset_texture_state(texture.texture)
+            sdl2.SDL_DestroyTexture(texture.texture)
+        self.game.close()
+
+    def texture(self, color):
+        surface = sdl2.SDL_CreateRGBSurfaceWithFormat(0, 8, 8, 32, sdl2.SDL_PIXELFORMAT_ARGB8888)
+        sdl2.SDL_FillRect(surface, None, sdl2.SDL_MapRGBA(surface.contents.format, *color))
+        texture = sdl2.SDL_CreateTextureFromSurface(self.game.renderer, surface)
+        sdl2.SDL_FreeSurface(surface)
+        return Texture(texture, (0, 0, 8, 8))
+
+    def render(self, draw_fn):
+        """Clears the draw area, calls draw_fn and returns the pixels"""
+        renderer = self.game.renderer
+        sdl2.SDL_SetRenderDrawColor(renderer, 0, 0, 255, 255)
+        sdl2.SDL_RenderClear(renderer)
+        draw_fn()
+
+        pixels = ctypes.create_string_buffer(64 * 64 * 4)
+        sdl2.SDL_RenderReadPixels(renderer, None, sdl2.SDL_PIXELFORMAT_ARGB8888, pixels, 64 * 4)
+        return pixels.raw
+
+    def draw_batch(self):
+        return self.render(lambda: self.renderer.draw_batch(self.batch))
+
+    def test_groups(self):
+        self.batch.add(self.red, 0, 0)
+        self.batch.add(self.green, 0, 0)
+        self.batch.add(self.red, 0, 0)
+
+        self.assertEqual(len(self.batch), 3)
+        self.assertEqual([group.texture for group in self.batch._groups],
+                         [self.red.texture, self.green.texture])
+
+    def test_tint_groups(self):
+        self.batch.add(self.red, 0, 0, tint=(255, 255, 255, 128))
+        self.batch.add(self.red, 0, 0, tint=(255, 255, 255, 64))
+
+        # with geometry the tint is in the colour of the vertices
+        self.assertEqual(len(self.batch._groups), 1 if self.geometry else 2)
+
+    def test_draw_order(self):
+        # the groups are drawn in the order they were first added
+        self.batch.add(self.red, 0, 0)
+        self.batch.add(self.green, 0, 0)
+        self.batch.add(self.red, 0, 0)
+        green = self.render(lambda: self.renderer.draw(self.green, 0, 0))
+        self.assertEqual(self.draw_batch(), green)
+
+        self.batch.add(self.green, 0, 0)
+        self.batch.add(self.red, 0, 0)
+        red = self.render(lambda: self.renderer.draw(self.red, 0, 0))
+        self.assertEqual(self.draw_batch(), red)
+
+    def test_same_as_draw(self):
+        sprites = [(self.red, 0, 0, None),
+                   (self.red, 4, 4, (255, 255, 255, 128)),
+                   (self.green, 20, 8, (0, 0, 255, 255)),
+                   (self.green, 30, 8, None),
+                   ]
+        for texture, x, y, tint in sprites:
+            self.batch.add(texture, x, y, tint=tint)
+
+        def draw():
+            for texture, x, y, tint in sprites:
+                self.renderer.draw(texture, x, y, tint=tint)
+
+        self.assertEqual(self.draw_batch(), self.render(draw))
+        self.assertEqual(len(self.batch), 0)
+
+    def test_clear_groups(self):
+        self.batch.add(self.red, 0, 0)
+        self.batch.clear()
+        self.batch.add(self.green, 0, 0)
+        self.batch.clear()
+
+        # only the groups used in the last frame are kept
+        self.assertEqual([group.texture for group in self.batch._group_map.values()],
+                         [self.green.texture])
+
+class GeometryBatchTestCase(BatchTestCase):
+
+    geometry = True
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+"""
+Tests for the broad phase collision detection (harness.collision).
+"""
+import random
+import unittest
+
+from harness.collision import SpatialHash
+
+def overlap(a, b):
+    return a[0] < b[0] + b[2] and b[0] < a[0] + a[2] and a[1] < b[1] + b[3] and b[1] < a[1] + a[3]
+
+class SpatialHashTestCase(unittest.TestCase):
+
+    def brute_force_pairs(self, rects):
+        keys = sorted(rects)
+        return set((a, b) for i, a in enumerate(keys) for b in keys[i + 1:] if overlap(rects[a], rects[b]))
+
+    def check_pairs(self, spatial_hash, rects):
+        pairs = spatial_hash.pairs()
+        normalized = [tuple(sorted(pair)) for pair in pairs]
+        # each pair only once
+        self.assertEqual(len(normalized), len(set(normalized)))
+        self.assertEqual(set(normalized), self.brute_force_pairs(rects))
+
+    def test_pairs_random(self):
+        rng = random.Random(42)
+        for cell_size in (8, 32, 100):
+            spatial_hash = SpatialHash(cell_size)
+            rects = {}
+            for i in range(300):
+                rects[i] = (rng.uniform(-200, 200), rng.uniform(-200, 200),
+                            rng.randint(1, 80), rng.randint(1, 80))
+                spatial_hash.insert(i, *rects[i])
+            self.check_pairs(spatial_hash, rects)
+
+            # move some, remove some
+            for i in range(0, 300, 3):
+                rects[i] = (rng.uniform(-200, 200), rng.uniform(-200, 200)) + rects[i][2:]
+                spatial_hash.move(i, *rects[i][:2])
+            for i in range(1, 300, 7):
+                del rects[i]
+                spatial_hash.remove(i)
+            self.assertEqual(len(spatial_hash), len(rects))
+            self.check_pairs(spatial_hash, rects)
+
+    def test_pairs_spanning_cells(self):
+        # overlapping in several cells, reported once
+        spatial_hash = SpatialHash(10)
+        spatial_hash.insert("a", 0, 0, 50, 50)
+        spatial_hash.insert("b", 5, 5, 40, 40)
+        self.assertEqual(len(spatial_hash.pairs()), 1)
+
+    def test_touching(self):
+        # rects sharing an edge don't overlap
+        spatial_hash = SpatialHash(16)
+        spatial_hash.insert("a", 0, 0, 16, 16)
+        spatial_hash.insert("b", 16, 0, 16, 16)
+        self.assertEqual(spatial_hash.pairs(), [])
+        self.assertEqual(spatial_hash.colliding("a"), [])
+
+    def test_query(self):
+        rng = random.Random(7)
+        spatial_hash = SpatialHash(20)
+        rects = {}
+        for i in range(100):
+            rects[i] = (rng.randint(0, 300), rng.randint(0, 300), rng.randint(1, 40), rng.randint(1, 40))
+            spatial_hash.insert(i, *rects[i])
+
+        for i in range(50):
+            area = (rng.randint(-20, 300), rng.randint(-20, 300), rng.randint(1, 100), rng.randint(1, 100))
+            expected = set(key for key, rect in rects.items() if overlap(rect, area))
+            self.assertEqual(set(spatial_hash.query(*area)), expected)
+
+            x, y = rng.randint(0, 300), rng.randint(0, 300)
+            expected = set(key for key, rect in rects.items() if overlap(rect, (x, y, 1, 1)))
+            self.assertEqual(set(spatial_hash.query_point(x, y)), expected)
+
+    def test_insert_moves(self):
+        spatial_hash = SpatialHash(16)
+        spatial_hash.insert("a", 0, 0, 8, 8)
+        spatial_hash.insert("a", 100, 100, 8, 8)
+        self.assertEqual(len(spatial_hash), 1)
+        self.assertEqual(spatial_hash.rect("a"), (100, 100, 8, 8))
+        self.assertEqual(spatial_hash.query(0, 0, 16, 16), [])
+
+        spatial_hash.clear()
+        self.assertEqual(len(spatial_hash), 0)
+        self.assertFalse("a" in spatial_hash)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+"""
+Tests for the game controller mappings included (harness.GameControllerDB).
+"""
+import unittest
+
+import sdl2
+
+from harness.GameControllerDB import mappings, init_game_controller
+
+PLATFORMS = ("Windows", "Mac OS X", "Linux")
+
+def embedded_lines():
+    """Returns the mappings included as (guid, name, platform) tuples"""
+    lines = []
+    for line in mappings.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        fields = line.rstrip(",").split(",")
+        platforms = [field[len("platform:"):] for field in fields if field.startswith("platform:")]
+        lines.append((fields[0], fields[1], platforms[0] if len(platforms) == 1 else None))
+    return lines
+
+class ControllerDBTestCase(unittest.TestCase):
+
+    def setUp(self):
+        sdl2.SDL_InitSubSystem(sdl2.SDL_INIT_GAMECONTROLLER)
+
+    def tearDown(self):
+        sdl2.SDL_QuitSubSystem(sdl2.SDL_INIT_GAMECONTROLLER)
+
+    def test_platform_field(self):
+        # SDL skips the lines without a "platform:" field (it is case sensitive)
+        for guid, name, platform in embedded_lines():
+            self.assertIn(platform, PLATFORMS, "%s (%s)" % (name, guid))
+
+    def test_mappings_added(self):
+        current = sdl2.SDL_GetPlatform().decode()
+        # the last mapping for a controller replaces the previous ones
+        expected = dict((guid, name) for guid, name, platform in embedded_lines() if platform == current)
+
+        self.assertGreaterEqual(init_game_controller(), 0)
+
+        added = 0
+        for guid, name in expected.items():
+            mapping = sdl2.SDL_GameControllerMappingForGUID(sdl2.SDL_JoystickGetGUIDFromString(guid.encode()))
+            if mapping and mapping.decode().split(",")[1] == name:
+                added += 1
+        self.assertEqual(added, len(expected))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+"""
+Tests for the layers cached in render targets (headless).
+"""
+import ctypes
+import unittest
+
+import sdl2
+
+from harness import Harness
+
+class LayerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.game = Harness(width=64, height=64, headless=True)
+        self.renderer = self.game.renderer_obj
+
+    def tearDown(self):
+        self.game.close()
+
+    def render(self, draw_fn):
+        """Clears the draw area, calls draw_fn and returns the pixels"""
+        renderer = self.game.renderer
+        sdl2.SDL_SetRenderDrawColor(renderer, 0, 0, 255, 255)
+        sdl2.SDL_RenderClear(renderer)
+        draw_fn()
+
+        pixels = ctypes.create_string_buffer(64 * 64 * 4)
+        sdl2.SDL_RenderReadPixels(renderer, None, sdl2.SDL_PIXELFORMAT_ARGB8888, pixels, 64 * 4)
+        return pixels.raw
+
+    def check_layer(self, content):
+        layer = self.game.layer(content)
+        layered = self.render(lambda: self.renderer.draw_layer(layer))
+        direct = self.render(lambda: content(self.renderer))
+        self.assertEqual(layered, direct)
+
+    def fill(self, rect, color, blend):
+        renderer = self.game.renderer
+        sdl2.SDL_SetRenderDrawBlendMode(renderer, blend)
+        sdl2.SDL_SetRenderDrawColor(renderer, *color)
+        sdl2.SDL_RenderFillRect(renderer, sdl2.SDL_Rect(*rect))
+        sdl2.SDL_SetRenderDrawBlendMode(renderer, sdl2.SDL_BLENDMODE_NONE)
+
+    def test_opaque(self):
+        def content(renderer):
+            self.fill((8, 8, 20, 20), (255, 0, 0, 255), sdl2.SDL_BLENDMODE_BLEND)
+            self.fill((16, 16, 30, 10), (0, 255, 0, 255), sdl2.SDL_BLENDMODE_BLEND)
+
+        self.check_layer(content)
+
+    def test_translucent(self):
+        def content(renderer):
+            self.fill((8, 8, 20, 20), (255, 0, 0, 255), sdl2.SDL_BLENDMODE_BLEND)
+            self.fill((16, 16, 30, 10), (0, 255, 0, 128), sdl2.SDL_BLENDMODE_BLEND)
+
+        layer = self.game.layer(content)
+        if not layer.premultiplied:
+            self.skipTest("the renderer doesn't support premultiplied alpha")
+        self.check_layer(content)
+
+    def test_invalidate(self):
+        color = [(255, 0, 0, 255)]
+
+        def content(renderer):
+            self.fill((0, 0, 64, 64), color[0], sdl2.SDL_BLENDMODE_NONE)
+
+        layer = self.game.layer(content)
+        red = self.render(lambda: self.renderer.draw_layer(layer))
+
+        color[0] = (0, 255, 0, 255)
+        self.assertEqual(self.render(lambda: self.renderer.draw_layer(layer)), red)
+
+        layer.invalidate()
+        self.assertNotEqual(self.render(lambda: self.renderer.draw_layer(layer)), red)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+"""
+Tests for the recording and replay of the keys (harness.replay).
+"""
+import os
+import ctypes
+import shutil
+import tempfile
+import unittest
+
+from harness.replay import Recorder, Replayer, HEADER
+
+UFPS = 80
+NUM_KEYS = 16
+
+class ReplayTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmp_dir, "replay.bin")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def record(self, states):
+        """Records a list of states (dictionaries of key: value by update)"""
+        recorder = Recorder(self.filename, UFPS, NUM_KEYS)
+        keys = (ctypes.c_uint8 * NUM_KEYS)()
+        recorded = []
+        for state in states:
+            for key, value in state.items():
+                keys[key] = value
+            recorder.record(keys)
+            recorded.append(list(keys))
+        recorder.close()
+        return recorded
+
+    def replay(self):
+        """Returns the replayer and the list of the states replayed"""
+        replayer = Replayer(self.filename, UFPS, NUM_KEYS)
+        keys = (ctypes.c_uint8 * NUM_KEYS)()
+        replayed = []
+        while not replayer.at_end:
+            self.assertTrue(replayer.apply(keys))
+            replayed.append(list(keys))
+        self.assertFalse(replayer.apply(keys))
+        replayer.close()
+        return replayer, replayed
+
+    def test_no_changes(self):
+        recorded = self.record([{}] * 30)
+        replayer, replayed = self.replay()
+        self.assertEqual(replayed, recorded)
+        self.assertEqual(replayer.updates, 30)
+        self.assertFalse(replayer.truncated)
+
+    def test_change_on_first_update(self):
+        states = [{} for i in range(30)]
+        states[0] = {3: 1}
+        states[10] = {3: 0, 15: 1}
+        states[11] = {0: 1}
+        states[29] = {15: 0}
+        recorded = self.record(states)
+        replayer, replayed = self.replay()
+        self.assertEqual(replayed, recorded)
+        self.assertEqual(replayed[0][3], 1)
+        self.assertFalse(replayer.truncated)
+
+    def test_long_gap(self):
+        # gaps over 127 updates use more than one byte
+        states = [{} for i in range(1000)]
+        states[500] = {7: 1}
+        states[999] = {7: 0}
+        recorded = self.record(states)
+        replayer, replayed = self.replay()
+        self.assertEqual(replayed, recorded)
+
+    def test_truncated(self):
+        states = [{} for i in range(30)]
+        states[0] = {3: 1}
+        states[10] = {3: 0, 15: 1}
+        states[20] = {15: 0}
+        recorded = self.record(states)
+
+        with open(self.filename, "rb") as fd:
+            data = fd.read()
+
+        for size in range(HEADER.size, len(data)):
+            with open(self.filename, "wb") as fd:
+                fd.write(data[:size])
+
+            replayer, replayed = self.replay()
+            self.assertTrue(replayer.truncated)
+            self.assertTrue(len(replayed) <= len(recorded))
+            self.assertEqual(replayed, recorded[:len(replayed)])
+
+        # only the end marker is missing, the update of the last record is replayed
+        self.assertEqual(len(replayed), 21)
+
+    def test_invalid_header(self):
+        self.record([{}] * 3)
+        self.assertRaises(ValueError, Replayer, self.filename, UFPS * 2, NUM_KEYS)
+        self.assertRaises(ValueError, Replayer, self.filename, UFPS, NUM_KEYS + 1)
+
+        with open(self.filename, "r+b") as fd:
+            fd.truncate(HEADER.size - 1)
+        self.assertRaises(ValueError, Replayer, self.filename, UFPS, NUM_KEYS)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,141 @@
+"""
+Tests for the texture state cache of the renderer (headless).
+"""
+import ctypes
+import unittest
+
+import sdl2
+
+from harness import Harness, SpriteBatch, Texture, has_render_geometry
+
+def create_texture(renderer, color, width=4, height=4):
+    """Returns a texture filled with a colour (r, g, b, a)"""
+    texture = sdl2.SDL_CreateTexture(renderer, sdl2.SDL_PIXELFORMAT_ARGB8888,
+                                     sdl2.SDL_TEXTUREACCESS_STATIC, width, height)
+    r, g, b, a = color
+    pixels = (ctypes.c_uint32 * (width * height))(*([(a << 24) | (r << 16) | (g << 8) | b] * (width * height)))
+    sdl2.SDL_UpdateTexture(texture, None, pixels, width * 4)
+    return texture
+
+def texture_mods(texture):
+    """Returns the colour, alpha and blend mode set to a texture"""
+    r, g, b, a = ctypes.c_uint8(), ctypes.c_uint8(), ctypes.c_uint8(), ctypes.c_uint8()
+    blend = sdl2.SDL_BlendMode()
+    sdl2.SDL_GetTextureColorMod(texture, ctypes.byref(r), ctypes.byref(g), ctypes.byref(b))
+    sdl2.SDL_GetTextureAlphaMod(texture, ctypes.byref(a))
+    sdl2.SDL_GetTextureBlendMode(texture, ctypes.byref(blend))
+    return (r.value, g.value, b.value), a.value, blend.value
+
+class TextureStateTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.game = Harness(width=64, height=64, headless=True)
+        self.renderer = self.game.renderer_obj
+        self.textures = []
+
+    def tearDown(self):
+        for texture in self.textures:
+            self.renderer.reset_texture_state(texture)
+            sdl2.SDL_DestroyTexture(texture)
+        self.game.close()
+
+    def texture(self, color=(255, 255, 255, 255)):
+        texture = create_texture(self.game.renderer, color)
+        self.textures.append(texture)
+        return texture
+
+    def pixel(self, x, y):
+        """Returns the (r, g, b) of a pixel of the draw area"""
+        pixel = ctypes.c_uint32()
+        sdl2.SDL_RenderReadPixels(self.game.renderer, sdl2.SDL_Rect(x, y, 1, 1),
+                                  sdl2.SDL_PIXELFORMAT_ARGB8888, ctypes.byref(pixel), 4)
+        value = pixel.value
+        return ((value >> 16) & 0xff, (value >> 8) & 0xff, value & 0xff)
+
+    def clear(self):
+        sdl2.SDL_SetRenderDrawColor(self.game.renderer, 0, 0, 0, 255)
+        sdl2.SDL_RenderClear(self.game.renderer)
+
+    def test_tint_restored(self):
+        texture = self.texture()
+
+        self.clear()
+        self.renderer.draw(texture, 0, 0, tint=(255, 0, 0))
+        self.assertEqual(self.pixel(0, 0), (255, 0, 0))
+        self.assertEqual(texture_mods(texture)[:2], ((255, 0, 0), 255))
+
+        self.clear()
+        self.renderer.draw(texture, 0, 0)
+        self.assertEqual(self.pixel(0, 0), (255, 255, 255))
+        self.assertEqual(texture_mods(texture)[:2], ((255, 255, 255), 255))
+
+    def test_direct_sdl_kept(self):
+        texture = self.texture()
+        sdl2.SDL_SetTextureColorMod(texture, 0, 0, 255)
+
+        self.clear()
+        self.renderer.draw(texture, 0, 0)
+        self.assertEqual(self.pixel(0, 0), (0, 0, 255))
+
+    def test_reset_texture_state(self):
+        texture = self.texture()
+
+        self.renderer.draw(texture, 0, 0, tint=(255, 0, 0))
+        self.assertIn(id(texture), self.renderer._texture_states)
+
+        self.renderer.reset_texture_state(Texture(texture, (0, 0, 4, 4)))
+        self.assertNotIn(id(texture), self.renderer._texture_states)
+
+    def test_eviction(self):
+        self.renderer.TEXTURE_STATES = 4
+        textures = [self.texture() for i in range(5)]
+
+        for texture in textures:
+            self.renderer.draw(texture, 0, 0, tint=(10, 20, 30, 40), blend=sdl2.SDL_BLENDMODE_ADD)
+        self.assertEqual(len(self.renderer._texture_states), 1)
+
+        # the textures forgotten are set back to their original state
+        for texture in textures[:4]:
+            self.assertEqual(texture_mods(texture), ((255, 255, 255), 255, sdl2.SDL_BLENDMODE_NONE))
+        self.assertEqual(texture_mods(textures[4]), ((10, 20, 30), 40, sdl2.SDL_BLENDMODE_ADD))
+
+    def test_targets_reset(self):
+        texture = self.texture()
+
+        self.renderer.draw(texture, 0, 0, tint=(255, 0, 0))
+        sdl2.SDL_SetTextureColorMod(texture, 0, 255, 0)
+        self.game._on_targets_reset(None)
+
+        self.clear()
+        self.renderer.draw(texture, 0, 0, tint=(255, 0, 0))
+        self.assertEqual(self.pixel(0, 0), (255, 0, 0))
+
+    def test_geometry_resync(self):
+        if not has_render_geometry():
+            self.skipTest("SDL_RenderGeometryRaw is not supported")
+
+        texture = self.texture()
+        batch = SpriteBatch(geometry=True)
+
+        self.renderer.draw(texture, 0, 0, tint=(255, 0, 0))
+        batch.add(Texture(texture, (0, 0, 4, 4)), 8, 8, tint=(0, 255, 0, 255))
+        self.clear()
+        self.renderer.draw_batch(batch, clear=False)
+        self.assertEqual(self.pixel(8, 8), (0, 255, 0))
+
+        # the colour of the vertices may be left in the texture
+        self.clear()
+        self.renderer.draw(texture, 0, 0)
+        self.assertEqual(self.pixel(0, 0), (255, 255, 255))
+
+        self.clear()
+        self.renderer.draw_batch(batch)
+        self.renderer.draw(texture, 0, 0, tint=(255, 255, 255, 255))
+        self.assertEqual(self.pixel(0, 0), (255, 255, 255))
+
+        self.clear()
+        self.renderer.draw(texture, 0, 0, tint=(255, 0, 0))
+        self.assertEqual(self.pixel(0, 0), (255, 0, 0))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+"""
+Tests for the chunks of the tile maps (headless).
+"""
+import ctypes
+import unittest
+
+import sdl2
+
+from harness import Harness, Texture, Tilemap
+
+# tiles of the tileset
+RED = 0
+GREEN = 1
+
+class TilemapTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.game = Harness(width=64, height=64, headless=True)
+        self.renderer = self.game.renderer_obj
+        if not sdl2.SDL_RenderTargetSupported(self.game.renderer):
+            self.skipTest("the renderer doesn't support render targets")
+
+        # 2 tiles of 4x4: red and green
+        surface = sdl2.SDL_CreateRGBSurfaceWithFormat(0, 8, 4, 32, sdl2.SDL_PIXELFORMAT_ARGB8888)
+        sdl2.SDL_FillRect(surface, sdl2.SDL_Rect(0, 0, 4, 4), sdl2.SDL_MapRGBA(surface.contents.format, 255, 0, 0, 255))
+        sdl2.SDL_FillRect(surface, sdl2.SDL_Rect(4, 0, 4, 4), sdl2.SDL_MapRGBA(surface.contents.format, 0, 255, 0, 255))
+        self.tileset = Texture(sdl2.SDL_CreateTextureFromSurface(self.game.renderer, surface), (0, 0, 8, 4))
+        sdl2.SDL_FreeSurface(surface)
+
+        # 4x4 tiles in chunks of 2x2 tiles
+        self.tilemap = Tilemap(self.tileset, 4, 4, 4, 4, data=[RED] * 16, chunk_size=2)
+
+    def tearDown(self):
+        self.tilemap.free()
+        self.renderer.reset_texture_state(self.tileset.texture)
+        sdl2.SDL_DestroyTexture(self.tileset.texture)
+        self.game.close()
+
+    def pixel(self, x, y):
+        """Returns the (r, g, b) of a pixel of the draw area"""
+        pixel = ctypes.c_uint32()
+        sdl2.SDL_RenderReadPixels(self.game.renderer, sdl2.SDL_Rect(x, y, 1, 1),
+                                  sdl2.SDL_PIXELFORMAT_ARGB8888, ctypes.byref(pixel), 4)
+        value = pixel.value
+        return ((value >> 16) & 0xff, (value >> 8) & 0xff, value & 0xff)
+
+    def draw(self):
+        """Draws the tile map, returns the number of tiles rendered into the chunks"""
+        sdl2.SDL_SetRenderDrawColor(self.game.renderer, 0, 0, 0, 255)
+        sdl2.SDL_RenderClear(self.game.renderer)
+
+        copies = self.renderer.copies
+        self.renderer.draw_tilemap(self.tilemap)
+        # plus one copy per chunk drawn (the map has 4 chunks)
+        return self.renderer.copies - copies - 4
+
+    def test_cached(self):
+        self.assertEqual(self.draw(), 16)
+        self.assertEqual(self.pixel(0, 0), (255, 0, 0))
+        self.assertEqual(self.draw(), 0)
+        self.assertEqual(self.pixel(15, 15), (255, 0, 0))
+
+    def test_set_tile(self):
+        self.draw()
+
+        self.tilemap.set_tile(3, 3, GREEN)
+        self.assertEqual(self.tilemap.get_tile(3, 3), GREEN)
+        # only the chunk of the tile is rendered again
+        self.assertEqual(self.draw(), 4)
+        self.assertEqual(self.pixel(12, 12), (0, 255, 0))
+        self.assertEqual(self.pixel(8, 8), (255, 0, 0))
+
+        # same tile, nothing to render
+        self.tilemap.set_tile(3, 3, GREEN)
+        self.assertEqual(self.draw(), 0)
+
+    def test_empty_tile(self):
+        self.draw()
+
+        self.tilemap.set_tile(0, 0, -1)
+        self.assertEqual(self.draw(), 3)
+        self.assertEqual(self.pixel(0, 0), (0, 0, 0))
+
+    def test_invalidate(self):
+        self.draw()
+
+        self.tilemap.data[0] = GREEN
+        self.assertEqual(self.draw(), 0)
+        self.assertEqual(self.pixel(0, 0), (255, 0, 0))
+
+        self.tilemap.invalidate()
+        self.assertEqual(self.draw(), 16)
+        self.assertEqual(self.pixel(0, 0), (0, 255, 0))
+
+    def test_targets_reset(self):
+        self.draw()
+
+        self.game._on_targets_reset(None)
+        self.assertEqual(self.draw(), 16)
+
+    def test_max_chunks(self):
+        self.tilemap.max_chunks = 2
+
+        self.draw()
+        self.assertEqual(len(self.tilemap._chunks), 2)
+        # the chunks are rendered again once evicted
+        self.assertEqual(self.draw(), 16)
+
+if __name__ == "__main__":
+    unittest.main()